@@ -2,8 +2,11 @@ import textworld
 import re
 import enum
 import random
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 import hypotheses
+import interning
 
 location_regex = re.compile(r'-=\s([\w\s]*)\s=-')
 infos = textworld.EnvInfos(description=True, entities=True, facts=True, feedback=True, game=True, policy_commands=True,
@@ -121,51 +124,129 @@ def get_experience_from_walkthrough(env: textworld.core.Wrapper, commands_to_act
     state = env.reset()
     curr_facts = state.facts
     optimal_policy = state.policy_commands
+    interner = interning.Interner()  # equal states give the same tuple, so their actions share a symbol table
     tuples = []
     for command in optimal_policy:
         new_state = env.step(command)[0]
         new_facts = new_state.facts
         if commands_to_actions:  # populate variables in actions with Variables from game state
-            tuples.append((curr_facts, command_to_action(command, curr_facts), new_facts))
+            tuples.append((curr_facts, command_to_action(command, interner.facts(curr_facts)), new_facts))
         else:
             tuples.append((curr_facts, command, new_facts))
         curr_facts = new_facts
     return tuples
 
 
-def collect_facts_by_object(facts: [textworld.logic.Proposition], object: textworld.logic.Variable):
-    """Collect all facts relating to a given object."""
-    return [prop for prop in facts if object in prop.arguments]
+class FactIndex:
+    """
+    Groups a list of facts by the objects occurring in them, in a single pass over the list, so that the facts about an
+    object can be looked up rather than searched for.
+    """
+
+    def __init__(self, facts: [textworld.logic.Proposition]):
+        self.facts = set(facts)
+        self.by_object = {}  # object -> facts in which it occurs, in the order of the list
+        self.heads = {}  # objects occurring as the first argument of some fact, in order of first occurrence
+        for prop in facts:
+            for object in dict.fromkeys(prop.arguments):  # a fact mentioning an object twice is still listed once
+                self.by_object.setdefault(object, []).append(prop)
+            if prop.arguments:
+                self.heads.setdefault(prop.arguments[0])
+
+    def __contains__(self, prop):
+        return prop in self.facts
+
+    def about(self, object):
+        """Returns the facts in which the object occurs."""
+        return self.by_object.get(object, [])
+
+
+def collect_facts_by_object(facts, object: textworld.logic.Variable):
+    """Collect all facts relating to a given object.
+    :param facts: list of facts or a FactIndex of them"""
+    if not isinstance(facts, FactIndex):
+        facts = FactIndex(facts)
+    return list(facts.about(object))
 
 
 def diff_facts(facts1: [textworld.logic.Proposition], facts2: [textworld.logic.Proposition]):
     """Differentiates between two fact sets. Compares facts of the same type with the same left-hand-side object
-    to establish whether there has been a change of state."""
+    to establish whether there has been a change of state. Takes time linear in the number of facts."""
     befores = set([])
     afters = set([])
-    objects = []
-    for fact in facts1:
-        object = fact.arguments[0]
-        if object not in objects:
-            objects.append(object)
-
-    for object in objects:
-        object_facts1_set = set(collect_facts_by_object(facts1, object))
-        object_facts2_set = set(collect_facts_by_object(facts2, object))
+    index1, index2 = FactIndex(facts1), FactIndex(facts2)
+    for object in index1.heads:
         # things that are true about object now but not in the future
-        befores = befores.union(object_facts1_set - object_facts2_set)
+        befores.update([prop for prop in index1.about(object) if prop not in index2])
         # things that are true about object in the future but not now
-        afters = afters.union(object_facts2_set - object_facts1_set)
+        afters.update([prop for prop in index2.about(object) if prop not in index1])
     return [befores, afters]
 
 
+symbol_tables = {}  # id of a tuple of facts -> (the tuple, its symbol table), see symbol_table
+max_symbol_tables = 32
+
+
+def symbol_table(facts: [textworld.logic.Proposition]):
+    """Maps the names of the objects occurring in a list of facts to their Variables, taking the first one in the list
+    where several share a name. Tables of tuples of facts, such as those of an Interner, are cached by the identity of
+    the tuple, since all the actions considered in a state are resolved against the same facts, and an Interner returns
+    the same tuple for equal states. Tuples can't be referenced weakly, so the cache holds on to them instead and is
+    kept small. Lists can change, so their tables are built anew every time."""
+    cached = isinstance(facts, tuple)
+    if cached:
+        entry = symbol_tables.get(id(facts))
+        if entry is not None and entry[0] is facts:
+            return entry[1]
+    table = {}
+    for prop in facts:
+        for arg in prop.arguments:
+            table.setdefault(arg.name, arg)
+    if cached:
+        if len(symbol_tables) >= max_symbol_tables:
+            del symbol_tables[next(iter(symbol_tables))]  # the oldest entry
+        symbol_tables[id(facts)] = (facts, table)
+    return table
+
+
+def find_var(name, facts):
+    """Returns the first Variable with the given name occurring in a list of facts, or None."""
+    for prop in facts:
+        for arg in prop.arguments:
+            if arg.name == name:
+                return arg
+    return None
+
+
 class Action:
+    # Actions are hashed by their template, arguments and variables. The hash is cached, and assigning new args or vars
+    # clears it, so these must be replaced rather than changed in place.
+    __slots__ = ('_args', '_vars', '_hash', 'repr', 'command_template')
+
     def __init__(self, command_template: str, *args, facts=None):
         self.args = args
         self.repr = command_template.format(*args)
         self.command_template = command_template
         self.vars = self.extract_variables(args, facts)
 
+    @property
+    def args(self):
+        return self._args
+
+    @args.setter
+    def args(self, args):
+        self._args = args
+        self._hash = None
+
+    @property
+    def vars(self):
+        return self._vars
+
+    @vars.setter
+    def vars(self, vars):
+        self._vars = vars
+        self._hash = None
+
     def __repr__(self):
         return 'Action: ' + self.command_template.format(*[str(var) if var is not None else arg for var, arg in zip(self.vars, self.args)])
 
@@ -174,27 +255,37 @@ class Action:
             return False
         return other.command_template == self.command_template and other.args == self.args and other.vars == self.vars
 
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self.command_template, tuple(self._args), tuple(self._vars)))
+        return self._hash
+
+    # strings hash differently in every process, so the cached hash isn't pickled; the textworld Variables in vars do
+    # pickle theirs, so they still have to be rebuilt in the receiving process, see rebuild_experience
+    def __getstate__(self):
+        return {slot: getattr(self, slot) for cls in type(self).__mro__ for slot in getattr(cls, '__slots__', ())
+                if slot != '_hash' and hasattr(self, slot)}
+
+    def __setstate__(self, state):
+        self._hash = None
+        for slot, value in state.items():
+            setattr(self, slot, value)
+
     def extract_variables(self, args, facts):
-        """Extracts all the variables with the same name as the args.
+        """Extracts all the variables with the same name as the args. Tuples of facts are resolved through their cached
+        symbol table. Lists can change, so they would need a new table every time, and are searched instead.
         :returns A list of textworld Variables"""
         variables = []
         #  if facts is None:
         #      return [None] * len(args) # if there are no facts, then no variable can occur in them
-
-        def find_var(name, facts):
-            if facts is None:
-                return None
-            for prop in facts:
-                for arg in prop.arguments:
-                    if arg.name == name:
-                        return arg
-            return None
-
+        table = symbol_table(facts) if isinstance(facts, tuple) else None
         for arg in args:
             if isinstance(arg, textworld.logic.Variable) or isinstance(arg, hypotheses.VariablePlaceholder):
                 variables.append(arg)
+            elif table is not None:
+                variables.append(table.get(arg))
             else:
-                variables.append(find_var(arg, facts))
+                variables.append(None if facts is None else find_var(arg, facts))
         return variables
 
     def as_command(self):
@@ -202,6 +293,8 @@ class Action:
 
 
 class Go(Action):
+    __slots__ = ('direction',)
+
     def __init__(self, direction: str, facts=None):
         """
         Movement action.
@@ -212,23 +305,31 @@ class Go(Action):
 
 
 class Look(Action):
+    __slots__ = ()
+
     def __init__(self):
         super(Look, self).__init__('look')
 
 
 class Open(Action):
+    __slots__ = ('thing',)
+
     def __init__(self, thing, facts=None):
         super(Open, self).__init__('open {0}', thing, facts=facts)
         self.thing = thing
 
 
 class Close(Action):
+    __slots__ = ('thing',)
+
     def __init__(self, thing, facts=None):
         super(Close, self).__init__('close {0}', thing, facts=facts)
         self.thing = thing
 
 
 class Take(Action):
+    __slots__ = ()
+
     def __init__(self, thing, container=None, facts=None):
         if container is None:
             super(Take, self).__init__('take {0}', thing, facts=facts)
@@ -239,6 +340,8 @@ class Take(Action):
 
 
 class Lock(Action):
+    __slots__ = ('thing', 'key')
+
     def __init__(self, thing, key=None, facts=None):
         if key is None:
             super(Lock, self).__init__('lock {0}', thing, facts=facts)
@@ -250,6 +353,8 @@ class Lock(Action):
 
 
 class Unlock(Action):
+    __slots__ = ('thing', 'key')
+
     def __init__(self, thing, key=None, facts=None):
         if key is None:
             super(Unlock, self).__init__('unlock {0}', thing, facts=facts)
@@ -260,6 +365,8 @@ class Unlock(Action):
 
 
 class Put(Action):
+    __slots__ = ('thing', 'place')
+
     def __init__(self, thing, place, facts=None):
         super(Put, self).__init__('put {0} on {1}', thing, place, facts=facts)
         self.thing = thing
@@ -267,6 +374,8 @@ class Put(Action):
 
 
 class Insert(Action):
+    __slots__ = ('thing', 'container')
+
     def __init__(self, thing, container, facts=None):
         super(Insert, self).__init__('insert {0} into {1}', thing, container, facts=facts)
         self.thing = thing
@@ -274,34 +383,46 @@ class Insert(Action):
 
 
 class Drop(Action):
+    __slots__ = ('thing',)
+
     def __init__(self, thing, facts=None):
         super(Drop, self).__init__('drop {0}', thing, facts=facts)
         self.thing = thing
 
 
 class Eat(Action):
+    __slots__ = ('thing',)
+
     def __init__(self, thing, facts=None):
         super(Eat, self).__init__('eat {0}', thing, facts=facts)
         self.thing = thing
 
 
 class Examine(Action):
+    __slots__ = ('thing',)
+
     def __init__(self, thing, facts=None):
         super(Examine, self).__init__('examine {0}', thing, facts=facts)
         self.thing = thing
 
 
 class Inventory(Action):
+    __slots__ = ()
+
     def __init__(self):
         super(Inventory, self).__init__('inventory')
 
 
 class YES(Action):
+    __slots__ = ()
+
     def __init__(self):
         super(YES, self).__init__('YES')
 
 
 class Moves(Action):  # a non-player action meant to symbolize an observation of something moving in environment
+    __slots__ = ()
+
     def __init__(self, arg1, source, dest, facts=None):
         super(Moves, self).__init__('{0} moves from {1} to {2}', arg1, source, dest, facts=facts)
 
@@ -332,24 +453,31 @@ name_to_action = {
 }
 
 
-def command_to_action(command: str, facts=None):
-    """Extracts the information within a text command and converts it to an Action object.
-    :param facts - if provided, will be used to find Variable representations of entity identifiers
+@lru_cache(maxsize=4096)
+def parse_command(command: str):
+    """Splits a text command into the Action class it names and its arguments. The same commands come up over and
+    over while playing, so the results are cached; they don't depend on the state, unlike the variables of an Action.
+    :return tuple (Action class, tuple of argument names)
     """
-
     parts = command.split()
     command_id = parts[0]  # command identifier (examine, eat, etc)
     spec = ' '.join(parts[1:]).strip()  # rest of the command
     if command_id in separators and separators[command_id] in command:
         arg1, arg2 = spec.split(separators[command_id])
-        action = name_to_action[command_id](arg1.strip(), arg2.strip(), facts=facts)
-    else:
-        arg = spec
-        if arg == '':
-            action = name_to_action[command_id]()
-        else:
-            action = name_to_action[command_id](arg, facts=facts)
-    return action
+        return name_to_action[command_id], (arg1.strip(), arg2.strip())
+    if spec == '':
+        return name_to_action[command_id], ()
+    return name_to_action[command_id], (spec,)
+
+
+def command_to_action(command: str, facts=None):
+    """Extracts the information within a text command and converts it to an Action object.
+    :param facts - if provided, will be used to find Variable representations of entity identifiers
+    """
+    action_class, args = parse_command(command)
+    if not args:
+        return action_class()
+    return action_class(*args, facts=facts)
 
 
 def fact_commonalities(fact1: textworld.logic.Proposition, fact2: textworld.logic.Proposition):
@@ -378,17 +506,22 @@ class ExperienceGatheringAgent(Agent):
     def reset(self):
         self.rng = random.Random(self.seed)
 
-    def act(self, game_state, reward, done):
+    def act(self, game_state, reward, done, facts=None):
+        """
+        :param facts: the facts of the game state, such as a tuple returned by an Interner, which lets actions in equal
+        states share a symbol table. game_state['facts'] by default.
+        """
+        facts = game_state['facts'] if facts is None else facts
         considered_entities = self.select_entities(game_state)
         action = self.select_action(game_state)
         if action in [YES, Look, Inventory]:
             filled_action = action()
         elif action in [Eat, Examine, Go, Open, Close, Drop]:
-            filled_action = action(considered_entities[0], facts=game_state['facts'])
+            filled_action = action(considered_entities[0], facts=facts)
         elif action in [Insert, Put]:
-            filled_action = action(*considered_entities, facts=game_state['facts'])
+            filled_action = action(*considered_entities, facts=facts)
         else:  # two-argument action, but can also take on a single argument
-            filled_action = action(*considered_entities[0:self.rng.randint(1, 2)], facts=game_state['facts'])
+            filled_action = action(*considered_entities[0:self.rng.randint(1, 2)], facts=facts)
         return filled_action
 
     def select_entities(self, game_state):
@@ -403,6 +536,8 @@ class ExperienceGatherer:
     def __init__(self, agent):
         self.agent = agent
         self.experience = []
+        self.transitions = set()  # the experiences in self.experience, so that repeated ones are found by hashing
+        self.interner = interning.Interner()  # states share the facts they have in common, and equal states are one
 
     def gather_experience(self, env, steps):
         steps_left = steps
@@ -410,10 +545,13 @@ class ExperienceGatherer:
         while True:
             if steps_left > 0:
                 steps_left -= 1
-                action = self.agent.act(state, 0, False)
+                facts = self.interner.facts(state.facts)
+                action = self.agent.act(state, 0, False, facts)
                 new_state, reward, done = env.step(action.repr)
-                if (state.facts, action, new_state.facts) not in self.experience:
-                    self.experience.append((state.facts, action, new_state.facts))
+                new_facts = self.interner.facts(new_state.facts)
+                if (facts, action, new_facts) not in self.transitions:
+                    self.transitions.add((facts, action, new_facts))
+                    self.experience.append((facts, action, new_facts))
                     state = new_state
                 if done:
                     break
@@ -421,13 +559,64 @@ class ExperienceGatherer:
                 break
         return self.experience
 
-    def gather_experience_multiple(self, game_paths, steps_per_game=500):
-        for game_path in game_paths:
-            env = textworld.start(game_path, infos)
-            self.gather_experience(env, steps_per_game)
+    def gather_experience_multiple(self, game_paths, steps_per_game=500, processes=None):
+        """Gathers experience from several games.
+        :param processes: number of worker processes to play the games in, each taking the next game from the list as
+        it becomes free. A game played in a worker gets a fresh agent of the same class, seeded with the seed of this
+        gatherer's agent plus the position of the game in the list, so the experience gathered is the same whichever
+        worker plays it. It is merged in the order of the games. By default, all games are played in this process by
+        this gatherer's agent, one after another.
+        """
+        if not processes:
+            for game_path in game_paths:
+                env = textworld.start(game_path, infos)
+                self.gather_experience(env, steps_per_game)
+            return self.experience
+        seeds = [self.agent.seed + ix for ix in range(len(game_paths))]
+        variables = {}  # (name, type) -> Variable, shared by all the rebuilt experiences
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for experiences in executor.map(gather_game, game_paths, [type(self.agent)] * len(game_paths), seeds,
+                                            [steps_per_game] * len(game_paths)):  # map keeps the order of the games
+                for experience in experiences:
+                    facts, action, new_facts = rebuild_experience(experience, variables)
+                    facts, new_facts = self.interner.facts(facts), self.interner.facts(new_facts)
+                    if (facts, action, new_facts) not in self.transitions:
+                        self.transitions.add((facts, action, new_facts))
+                        self.experience.append((facts, action, new_facts))
         return self.experience
 
 
+def gather_game(game_path, agent_class, seed, steps):
+    """Gathers experience from a single game with a new agent. Run by ExperienceGatherer.gather_experience_multiple in
+    worker processes.
+    :return list of experiences, in the order they were gathered"""
+    gatherer = ExperienceGatherer(agent_class(seed))
+    return gatherer.gather_experience(textworld.start(game_path, infos), steps)
+
+
+def rebuild_experience(experience, variables):
+    """Builds the facts of an experience that comes from another process, and the Variables of its action, anew.
+    Strings hash differently in every process, and textworld Variables and Propositions pickle the hashes they cached,
+    as would Actions if they didn't leave theirs out, so the unpickled objects can't be looked up in sets and
+    dictionaries of this process.
+    :param variables: (name, type) -> Variable rebuilt so far, to be shared by all experiences from the same source
+    :return the experience as (facts, action, facts)"""
+    def variable(var):
+        if type(var) != textworld.logic.Variable:
+            return var
+        key = var.name, var.type
+        if key not in variables:
+            variables[key] = textworld.logic.Variable(var.name, var.type)
+        return variables[key]
+
+    def rebuild(facts):
+        return [textworld.logic.Proposition(prop.name, [variable(arg) for arg in prop.arguments]) for prop in facts]
+
+    facts, action, new_facts = experience
+    action.vars = [variable(var) for var in action.vars]
+    return rebuild(facts), action, rebuild(new_facts)
+
+
 
 # Predicate structure:
 # There exists x/For all x:
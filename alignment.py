@@ -0,0 +1,95 @@
+import numpy as np
+
+import hypotheses
+
+
+def buckets(props):
+    '''Groups the positions of Propositions by name and arity, keeping their order.
+    :return dict (name, arity) -> [position...]'''
+    groups = {}
+    for ix, prop in enumerate(props):
+        groups.setdefault((prop.name, len(prop.arguments)), []).append(ix)
+    return groups
+
+
+def rating_matrix(props1, props2, terms):
+    '''Rates every Proposition of props1 against every Proposition of props2, like hypotheses.match_propositions does
+    for a single one. All Propositions must have the same name and arity.
+    :param terms - term -> id, shared by both lists so that equal arguments get equal ids
+    :return integer array with a row for every Proposition of props1 and a column for every one of props2'''
+    arity = len(props1[0].arguments)
+    args1 = np.array([[terms.setdefault(arg, len(terms)) for arg in prop.arguments] for prop in props1],
+                     dtype=np.int64).reshape(len(props1), 1, arity)
+    args2 = np.array([[terms.setdefault(arg, len(terms)) for arg in prop.arguments] for prop in props2],
+                     dtype=np.int64).reshape(1, len(props2), arity)
+    mask1 = np.array([hypotheses.placeholder_mask(prop) for prop in props1], dtype=bool).reshape(len(props1), 1, arity)
+    mask2 = np.array([hypotheses.placeholder_mask(prop) for prop in props2], dtype=bool).reshape(1, len(props2), arity)
+    # +1 for equal arguments or two placeholders, 0 for a placeholder and a concrete argument, -1 otherwise
+    ratings = np.where(mask1 & mask2, 1, np.where(mask1 ^ mask2, 0, np.where(args1 == args2, 1, -1)))
+    return ratings.sum(axis=2)
+
+
+def assign(ratings):
+    '''Solves the assignment problem for a rating matrix with no more rows than columns: finds the column for every row,
+    using every column at most once, such that the sum of the ratings is as high as possible. This is the Hungarian
+    method with shortest augmenting paths, taking O(rows² · columns) time.
+    :return list of the column assigned to each row'''
+    rows, columns = ratings.shape
+    if rows > columns:
+        raise ValueError('Cannot assign %d rows to %d columns' % (rows, columns))
+    cost = -ratings.astype(np.float64)
+    row_potential = np.zeros(rows + 1)
+    column_potential = np.zeros(columns + 1)
+    owner = np.zeros(columns + 1, dtype=np.int64)  # row assigned to each column, counted from 1; 0 is unassigned
+    way = np.zeros(columns + 1, dtype=np.int64)  # previous column on the augmenting path
+    for row in range(1, rows + 1):
+        owner[0] = row
+        column = 0
+        slack = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+        while True:  # grow the tree of alternating paths until it reaches an unassigned column
+            used[column] = True
+            current = owner[column]
+            free = ~used[1:]
+            reduced = cost[current - 1] - row_potential[current] - column_potential[1:]
+            improved = free & (reduced < slack[1:])
+            slack[1:][improved] = reduced[improved]
+            way[1:][improved] = column
+            candidates = np.where(free, slack[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            row_potential[owner[used]] += delta
+            column_potential[used] -= delta
+            slack[1:][free] -= delta
+            column = next_column
+            if owner[column] == 0:
+                break
+        while column:  # flip the assignments along the augmenting path
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+    assignment = [0] * rows
+    for column in range(1, columns + 1):
+        if owner[column]:
+            assignment[owner[column] - 1] = column - 1
+    return assignment
+
+
+def align_prop_lists(props1, props2):
+    '''Optimal version of hypotheses.align_prop_lists. Propositions can only be paired with Propositions of the same
+    name and arity, so the lists are split into such buckets, and each bucket is aligned such that the sum of the ratings
+    of its pairs is as high as possible, rather than by pairing each Proposition with the best one left in turn.
+    :return list of (Proposition of props1, Proposition of props2) in the order of props1, or None, None if some
+    Proposition of props1 has no counterpart'''
+    groups2 = buckets(props2)
+    matches = [None] * len(props1)
+    terms = {}
+    for key, positions1 in buckets(props1).items():
+        positions2 = groups2.get(key, [])
+        if len(positions2) < len(positions1):
+            return None, None
+        bucket1 = [props1[ix] for ix in positions1]
+        bucket2 = [props2[ix] for ix in positions2]
+        for ix, column in zip(positions1, assign(rating_matrix(bucket1, bucket2, terms))):
+            matches[ix] = bucket2[column]
+    return list(zip(props1, matches))
@@ -1,8 +1,14 @@
 import imageschemas
 import agent
 from textworld.logic import Proposition, Variable
-from uuid import uuid4
-from copy import deepcopy
+from copy import copy
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left, insort
+import heapq
+from itertools import count
+import sys
 
 
 class SpatialPrimitive(Proposition):
@@ -23,6 +29,8 @@ class In(SpatialPrimitive):
 
 
 class Placeholder:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -30,21 +38,46 @@ class Placeholder:
         return True
 
 
+placeholder_ids = count(1)  # source of VariablePlaceholder ids, which are unique within a process
+
+
+def reserve_placeholder_id(placeholder_id):
+    '''Makes sure the given id is never handed out to a new VariablePlaceholder in this process, because a placeholder
+    with that id came from elsewhere.'''
+    global placeholder_ids
+    next_id = next(placeholder_ids)
+    placeholder_ids = count(max(next_id, placeholder_id + 1))
+
+
+def restore_placeholder(placeholder_id, held_variable, position):
+    '''Recreates a pickled VariablePlaceholder.'''
+    reserve_placeholder_id(placeholder_id)
+    return VariablePlaceholder(held_variable, position, placeholder_id)
+
+
 class VariablePlaceholder(Placeholder):
     '''
     Placeholder for a variable in a Proposition. Can be filled to hold an actual variable.
     '''
+    __slots__ = ('id', 'position', 'held_variable', '_name')
+    type = '*'
 
-    def __init__(self, var=None, position=None):
+    def __init__(self, var=None, position=None, placeholder_id=None):
         self.position = position
-        self.id = uuid4()  # unique variable placeholder identifier
-        self.name = 'VAR-' + str(self.id)[-12:]
-        self.type = '*'
+        # unique variable placeholder identifier
+        self.id = next(placeholder_ids) if placeholder_id is None else placeholder_id
+        self._name = None  # built when it is first needed
         if type(var) == Variable or var is None:
             self.held_variable = var
         else:
             raise Exception('VariablePlaceholders can only hold instances of Variables')
 
+    @property
+    def name(self):
+        if self._name is None:
+            self._name = 'VAR-%d' % self.id
+        return self._name
+
     def fill(self, var):
         if type(var) == Variable and var is not None:
             self.held_variable = var
@@ -56,13 +89,23 @@ class VariablePlaceholder(Placeholder):
         return self.held_variable is not None and variable_placeholder.held_variable == self.held_variable
 
     def __repr__(self):
-        return '[VAR-%s]' % str(self.id)[-12:] if self.held_variable is None else '[%s]' % self.held_variable
+        return '[VAR-%d]' % self.id if self.held_variable is None else '[%s]' % self.held_variable
 
     def __eq__(self, other):
         return type(other) == VariablePlaceholder and other.id == self.id and other.held_variable == self.held_variable
 
     def __hash__(self):
-        return self.id.int
+        return self.id
+
+    def __copy__(self):
+        return VariablePlaceholder(self.held_variable, self.position, self.id)
+
+    def __deepcopy__(self, memo):  # Variables are immutable, so the copy can share the held one
+        memo[id(self)] = copy = VariablePlaceholder(self.held_variable, self.position, self.id)
+        return copy
+
+    def __reduce__(self):  # ids are only unique within a process, so unpickling reserves them
+        return restore_placeholder, (self.id, self.held_variable, self.position)
 
 
 class WordPlaceholder(Placeholder):
@@ -96,26 +139,109 @@ class Hypothesis:
         self.post = post
 
 
-def align_prop_lists(props1, props2):
+greedy_alignment_limit = 16  # longest Proposition lists which align_prop_lists aligns greedily by default
+
+
+def align_prop_lists(props1, props2, method='auto'):
+    '''Pairs every Proposition of props1 with a different Proposition of props2 of the same name and arity.
+    :param method - 'greedy' to pair each Proposition in turn with the best rated one left, as match_propositions rates
+    them, 'optimal' to pair them such that the sum of the ratings is as high as possible with the alignment module, or
+    'auto' to align lists longer than greedy_alignment_limit optimally and shorter ones greedily, which is faster for
+    them
+    :return list of (Proposition of props1, Proposition of props2) in the order of props1, or None, None if some
+    Proposition of props1 has no counterpart'''
+    if method == 'auto':
+        method = 'greedy' if len(props1) <= greedy_alignment_limit else 'optimal'
+    if method == 'optimal':
+        import alignment  # imported here, so that numpy is only needed when it is used
+        return alignment.align_prop_lists(props1, props2)
+    buckets = {}  # (name, arity) -> Propositions of props2 which haven't been paired yet, in order
+    for prop in props2:
+        buckets.setdefault((prop.name, len(prop.arguments)), []).append(prop)
     prop_pairs = []
-    props2_copy = deepcopy(props2)
     for prop in props1:
-        match, score = match_propositions(prop, props2_copy)
+        bucket = buckets.get((prop.name, len(prop.arguments)), [])
+        match, score = match_propositions(prop, bucket)
         if match is None:  # exception since there are no matching Propositions in the other pattern
             return None, None
         prop_pairs.append((prop, match))
-        props2_copy.remove(match)  # a matching prop can't be reused
+        # a matching prop can't be reused; it is removed by identity, which spares comparing it to the props before it
+        del bucket[[p is match for p in bucket].index(True)]
     return prop_pairs
 
 
+class Substitution:
+    '''Substitutions made while reconciling two patterns, as a union-find forest for each of them. Substituting a
+    placeholder for a term merges the two into one class, which is represented by the first placeholder substituted for
+    any of its members. A term thus keeps standing for the same placeholder once it was substituted, even if that
+    placeholder is generalised further in a later Proposition. Every merge is recorded on a trail, so that a failed step
+    can be undone without copying the substitutions beforehand.'''
+
+    def __init__(self):
+        self.parents = ({}, {})  # term -> term of the same class closer to its representative, for each pattern
+        self.placeholders = (set(), set())  # placeholders substituted for some term, for each of the two patterns
+        self.trail = []  # (pattern, term given a parent, substituted placeholder) in the order of the merges
+
+    def __len__(self):
+        return len(self.trail)
+
+    def find(self, side, term):
+        '''Returns what a term of the first (side 0) or second (side 1) pattern is substituted by, or the term itself.'''
+        parents = self.parents[side]
+        while term in parents:
+            term = parents[term]
+        return term
+
+    def union(self, side, term, placeholder):
+        '''Substitutes a fresh placeholder for a term of the first (side 0) or second (side 1) pattern.'''
+        root = self.find(side, term)
+        if self.is_substitute(side, root):  # the class already has a representative, the placeholder joins it
+            child, parent = placeholder, root
+        else:
+            child, parent = root, placeholder
+        self.parents[side][child] = parent
+        self.placeholders[side].add(placeholder)
+        self.trail.append((side, child, placeholder))
+
+    def is_substitute(self, side, term):
+        '''Tells whether a term is a placeholder that was substituted for some term of the given pattern.'''
+        return term in self.placeholders[side]
+
+    def mark(self):
+        '''Returns the current state of the substitutions, to be restored with undo.'''
+        return len(self.trail)
+
+    def undo(self, mark):
+        '''Takes back every merge made since mark was called.'''
+        while len(self.trail) > mark:
+            side, child, placeholder = self.trail.pop()
+            del self.parents[side][child]
+            self.placeholders[side].discard(placeholder)
+
+    def substitute(self, side, prop):
+        '''Substitutes the arguments of a Proposition of the first (side 0) or second (side 1) pattern.'''
+        return Proposition(prop.name, [self.find(side, arg) for arg in prop.arguments])
+
+    def substitute_action(self, side, action):
+        '''Substitutes the variables of an Action of the first (side 0) or second (side 1) pattern.'''
+        return substitute_action_arguments(action, {var: self.find(side, var) for var in action.vars
+                                                    if var in self.parents[side]})
+
+    def as_dicts(self):
+        '''Returns the substitutions as two dictionaries, mapping each substituted term of the first and second pattern to
+        what it is substituted by.'''
+        return tuple([{term: self.find(side, term) for term in self.parents[side] if not self.is_substitute(side, term)}
+                      for side in (0, 1)])
+
+
 def reconcile_patterns(pat1, pat2) -> tuple:
     '''Attempts to find a suitable substitution for a pattern of Proposition - Action - Proposition, such as in an image
     schema like CONTAINMENT.
 
     :param pat1 tuple of (Proposition, Action, Proposition)
     :param pat2 tuple of (Proposition, Action, Proposition)
-    :return (sub, dict) tuple of (pattern with substitutions, substitution dictionary) if reconciliation was possible,
-    (None, None) otherwise - this in turn means either an exception or relaxation needs to take place.'''
+    :return (sub, dicts) tuple of (pattern with substitutions, pair of substitution dictionaries) if reconciliation was
+    possible, (None, None) otherwise - this in turn means either an exception or relaxation needs to take place.'''
     pre1, pre2 = pat1[0], pat2[0]
     act1, act2 = pat1[1], pat2[1]
     post1, post2 = pat1[2], pat2[2]
@@ -128,72 +254,74 @@ def reconcile_patterns(pat1, pat2) -> tuple:
     if pre_pairs == (None, None):
         return None, None
 
-    pre_subs, pre_subs_dicts = reconcile_prop_pairs(pre_pairs)
+    pre_subs, substitution = reconcile_prop_pairs(pre_pairs)
+    if pre_subs is None:
+        return None, None
 
     # substitute arguments in the action with VariablePlaceholder, assuming there is an action (i.e. non-static image
     # schema)
-    act1_sub = substitute_action_arguments(act1, pre_subs_dicts[0]) if act1 is not None else None
-    act2_sub = substitute_action_arguments(act2, pre_subs_dicts[1]) if act1 is not None else None
+    act1_sub = substitution.substitute_action(0, act1) if act1 is not None else None
+    act2_sub = substitution.substitute_action(1, act2) if act1 is not None else None
 
     # the actions can differ on arguments that haven't appeared in the pre-conditions (for example, we could speak
     # metaphorically "put something on hold" or haven't mentioned another object that is always there, like "throw
     # something behind"). we reconcile them so that we can further propagate the substitutions
-    act_subs, act_subs_dicts = reconcile_actions(act1_sub, act2_sub, pre_subs_dicts[0], pre_subs_dicts[1])
+    act_subs, act_substitution = reconcile_actions(act1_sub, act2_sub, substitution)
 
-    if (act_subs, act_subs_dicts) == (None, None):
+    if (act_subs, act_substitution) == (None, None):
         return None, None  # if we can't reconcile the actions, then it's a separate experience
 
     # there's no telling the two post-conditions must match, so first substitute then reconcile
-    post_sub1 = [substitute(p, act_subs_dicts[0]) for p in post1]
-    post_sub2 = [substitute(p, act_subs_dicts[1]) for p in post2]
+    post_sub1 = [substitution.substitute(0, p) for p in post1]
+    post_sub2 = [substitution.substitute(1, p) for p in post2]
 
     post_pairs = align_prop_lists(post_sub1, post_sub2)
     if post_pairs == (None, None):  # in case the post-conditions don't match, it's an exception (different pattern)
         return None, None
-    post_rec, post_rec_subs_dicts = reconcile_prop_pairs(post_pairs)
+    post_rec, post_substitution = reconcile_prop_pairs(post_pairs)
 
-    if post_rec is None or (len(post_rec_subs_dicts[0]) + len(post_rec_subs_dicts[1])) > 0:
+    if post_rec is None or len(post_substitution) > 0:
         return None, None  # this is a separate sub-rule, the post-conditions express a different transition,
         # so it should be treated as an exception
 
-    return (pre_subs, act_subs, post_rec), pre_subs_dicts
+    return (pre_subs, act_subs, post_rec), substitution.as_dicts()
 
 
-def reconcile_prop_pairs(prop_pairs):
+def reconcile_prop_pairs(prop_pairs, substitution=None):
     '''Reconciles a list of pairs of Propositions, if possible.
     :param prop_pairs list of (Proposition, Proposition), usually matched through align_prop_lists.
-    :return list of reconciled Propositions, and a dictionary of substitutions, or None, None if reconciliation failed
-    at any step'''
+    :param substitution Substitution to take into account and to add to, or None to start from no substitutions.
+    :return list of reconciled Propositions, and the Substitution, or None, None if reconciliation failed at any step, in
+    which case the given Substitution is left as it was'''
+    if substitution is None:
+        substitution = Substitution()
+    mark = substitution.mark()
     prop_subs = []
-    prop_subs_dicts = [{}, {}]
     for prop, match in prop_pairs:
-        prop_subbed = deepcopy(prop)
-        match_subbed = deepcopy(match)
-        sub_dicts_1, sub_dicts_2 = prop_subs_dicts  # first make sure previous substitutions are taken into account
-        prop_subbed = substitute(prop_subbed, sub_dicts_1)
-        match_subbed = substitute(match_subbed, sub_dicts_2)
+        prop_subbed = substitution.substitute(0, prop)  # first make sure previous substitutions are taken into account
+        match_subbed = substitution.substitute(1, match)
         prop_sub, prop_subs_dict = reconcile_props(prop_subbed, match_subbed)  # derive any unresolved substitutions
         if prop_sub is None:
-            prop_subs = None
-            break
-        else:
-            prop_subs.append(prop_sub)
-            prop_subs_dicts[0].update(prop_subs_dict[0])
-            prop_subs_dicts[1].update(prop_subs_dict[1])
-    if prop_subs is None:
-        return None, None  # can't reconcile
-    return prop_subs, prop_subs_dicts
+            substitution.undo(mark)
+            return None, None  # can't reconcile
+        prop_subs.append(prop_sub)
+        for side in (0, 1):
+            for term, placeholder in prop_subs_dict[side].items():
+                substitution.union(side, term, placeholder)
+    return prop_subs, substitution
 
 
-def reconcile_actions(act1, act2, already_subbed1={}, already_subbed2={}):
+def reconcile_actions(act1, act2, substitution=None):
     '''Reconciles two Actions - they can be reconciled if both are of the same type and have the same amount of
     arguments.
     :param act1 Action
     :param act2 Action
-    :param already_subbed1 Dictionary of already made substitutions (for example, if reconcile_actions is called after
-    reconcile_props in a forward inference for the first proposition list
-    :param already_subbed2 same as already_subbed1 but for the second proposition list
-    :return (Action, {Variable: VariablePlaceholder}) tuple of substituted Action and substitution dictionary.'''
+    :param substitution Substitution of already made substitutions (for example, if reconcile_actions is called after
+    reconcile_props in a forward inference), which is added to, or None to start from no substitutions
+    :return (Action, Substitution) tuple of substituted Action and the substitutions, or None, None if the Actions can't
+    be reconciled, in which case the given Substitution is left as it was.'''
+    if substitution is None:
+        substitution = Substitution()
     subs_dict1 = {}
     subs_dict2 = {}
     vars = []
@@ -219,8 +347,8 @@ def reconcile_actions(act1, act2, already_subbed1={}, already_subbed2={}):
                         # isn't, meaning this is also a different context, such as
                         # P(A, B) -> Act(A, X) ...
                         # P(C, D) -> Act(VP,Y) ...
-                        elif (var1 in already_subbed1.values() and var2 not in already_subbed2.values() or \
-                              (var1 not in already_subbed1.values() and var2 in already_subbed1.values())):
+                        elif (substitution.is_substitute(0, var1) and not substitution.is_substitute(1, var2) or
+                              (not substitution.is_substitute(0, var1) and substitution.is_substitute(0, var2))):
                             return None, None
                         # both are fine and don't need any substituting (either because they are already a result
                         # of substitution, or because they existed as variable placeholders from the start)
@@ -232,9 +360,9 @@ def reconcile_actions(act1, act2, already_subbed1={}, already_subbed2={}):
                     # and so a new pattern. (if this was the same pattern, there would be two corresponding
                     # variable placeholders)
                     elif (type(var1) == VariablePlaceholder and type(var2) == Variable and \
-                        (var1 in already_subbed1.values())) or \
+                        substitution.is_substitute(0, var1)) or \
                             (type(var1) == Variable and type(var2) == VariablePlaceholder and \
-                             var2 in already_subbed2.values()):
+                             substitution.is_substitute(1, var2)):
                         return None, None
                     # otherwise, it's a variable placeholder against a variable, and the variable placeholder isn't
                     # a result of a previous substitution
@@ -246,15 +374,17 @@ def reconcile_actions(act1, act2, already_subbed1={}, already_subbed2={}):
                         vars.append(vp1)
     else:
         if not act1 and not act2:  # both actions are None
-            return None, (already_subbed1, already_subbed2)
+            return None, substitution
         else:  # one action is None, another isn't
             return None, None
     if len(vars) != len(act1.vars): # something else failed, a correct reconciliation cannot shorten the amount of vars
         return None, None
     else:
-        already_subbed1.update(subs_dict1)
-        already_subbed2.update(subs_dict2)
-        return type(act1)(*vars), (already_subbed1, already_subbed2)
+        for var, placeholder in subs_dict1.items():
+            substitution.union(0, var, placeholder)
+        for var, placeholder in subs_dict2.items():
+            substitution.union(1, var, placeholder)
+        return type(act1)(*vars), substitution
 
 
 def match_propositions(prop, prop_list):
@@ -278,7 +408,7 @@ def match_propositions(prop, prop_list):
             else:
                 rating -= 1
         ratings.append((candidate, rating))
-    return sorted(ratings, key=lambda r: r[1], reverse=True)[0]
+    return max(ratings, key=lambda r: r[1])  # the first of the best rated candidates
 
 
 # def reconcile_actions(action1, action2):
@@ -378,108 +508,1196 @@ def substitute_action_arguments(action, substitutions):
     return subbed_action
 
 
+def renumber_placeholders(patterns):
+    '''Gives the VariablePlaceholders in a list of patterns new ids from this process. Placeholder ids are only unique
+    within the process that made them, so patterns learned in another process need new ids before they are merged into
+    a store. Placeholders which were equal stay equal, and a placeholder shared between Propositions stays shared.
+    :return list of patterns with the renumbered placeholders'''
+    ids = {}  # old id -> new id
+    copies = {}  # id() of a placeholder -> its renumbered copy
+
+    def renumber(term):
+        if type(term) != VariablePlaceholder:
+            return term
+        if id(term) not in copies:
+            placeholder = VariablePlaceholder(term.held_variable, term.position)
+            placeholder.id = ids.setdefault(term.id, placeholder.id)
+            copies[id(term)] = placeholder
+        return copies[id(term)]
+
+    renumbered = []
+    for pre, act, post in patterns:
+        pre = [Proposition(prop.name, [renumber(arg) for arg in prop.arguments]) for prop in pre]
+        post = [Proposition(prop.name, [renumber(arg) for arg in prop.arguments]) for prop in post]
+        if act is not None and any([type(var) == VariablePlaceholder for var in act.vars]):
+            new_vars = [renumber(var) for var in act.vars]
+            # arguments are either the placeholders themselves or their names, see substitute_action_arguments
+            new_args = [new_var.name if type(var) == VariablePlaceholder and arg == var.name else renumber(arg)
+                        for arg, var, new_var in zip(act.args, act.vars, new_vars)]
+            act = type(act)(*new_args)
+            act.vars = new_vars
+        renumbered.append((pre, act, post))
+    return renumbered
+
+
+class FrozenList(list):
+    '''List of Propositions of a stored pattern. Compares equal to ordinary lists, but can't be changed, so that
+    patterns can be shared between stores, caches and inferences without copying them.'''
+
+    def immutable(self, *args, **kwargs):
+        raise Exception('Patterns in a store can\'t be changed')
+
+    append = extend = insert = remove = pop = clear = sort = reverse = immutable
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = immutable
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+
+def freeze_pattern(pattern):
+    '''Returns the pattern with its Proposition lists made immutable.'''
+    pre, act, post = pattern
+    if type(pre) == FrozenList and type(post) == FrozenList:
+        return pattern
+    return FrozenList(pre), act, FrozenList(post)
+
+
+def pattern_signature(pattern):
+    '''Computes the signature of a pattern - the multisets of names of its pre- and post-condition Propositions along
+    with the type of its Action. Two patterns can only be reconciled if their signatures agree.
+    :param pattern - a pattern of the form ([Proposition...], Action, [Proposition])
+    :return tuple (pre names, action type, post names), where the names are sorted tuples'''
+    pre, act, post = pattern
+    return tuple(sorted([p.name for p in pre])), type(act), tuple(sorted([p.name for p in post]))
+
+
 def propositions_actions_names_match(pattern1, pattern2):
     '''Helper function to check if the names of propositions and actions in a pattern agree.'''
-    pre1, act1, post1 = pattern1
-    pre2, act2, post2 = pattern2
-    return set([p.name for p in pre1]) == set([p.name for p in pre2]) and type(act1) == type(act2) \
-           and set([p.name for p in post2]) == set([p.name for p in post2])
+    return pattern_signature(pattern1) == pattern_signature(pattern2)
+
+
+def pattern_features(pattern):
+    '''Collects the features of a pattern by which it can be found in the inverted index of a PatternStore: the names
+    of its Propositions, the type of its Action and the names of the concrete Variables occurring in either.
+    :return set of (kind, value) tuples'''
+    pre, act, post = pattern
+    features = set()
+    for prop in list(pre) + list(post):
+        features.add(('proposition', prop.name))
+        for arg in prop.arguments:
+            if type(arg) == Variable:
+                features.add(('variable', arg.name))
+    if act is not None:
+        features.add(('action', type(act)))
+        for var in act.vars:
+            if type(var) == Variable:
+                features.add(('variable', var.name))
+    return features
+
+
+def placeholder_mask(prop):
+    '''Returns for every argument of a Proposition whether it is a VariablePlaceholder.'''
+    return tuple([type(arg) == VariablePlaceholder for arg in prop.arguments])
+
+
+def pattern_profile(pattern):
+    '''Summarises what a pattern can score in most_similar_pattern at best: the type of its action, the number of
+    variables of the action, and the name, arity and placeholder positions of each of its Propositions. Patterns which
+    only differ in their concrete Variables have the same profile.
+    :return hashable tuple (action type, number of action variables, propositions)'''
+    pre, act, post = pattern
+    props = set([(0, prop.name, len(prop.arguments), placeholder_mask(prop)) for prop in pre])
+    props.update([(2, prop.name, len(prop.arguments), placeholder_mask(prop)) for prop in post])
+    return type(act), len(act.vars) if isinstance(act, agent.Action) else 0, tuple(sorted(props))
+
+
+schema_versions = count()  # source of SchemaIndex versions, unique across all stores
+use_clock = count(1)  # source of the times patterns were last used, see SchemaIndex.last_use
+
+
+class SchemaIndex:
+    '''Index over the list of patterns stored under a single schema name. Maps pattern signatures to the positions of
+    the patterns with that signature, in the order they occur in the list, and keeps an inverted index from the features
+    of patterns (see pattern_features) to the positions of the patterns which have them, and from canonical forms (see
+    canonical_form) to the positions of the patterns with that form. Also keeps statistics of how each pattern is used,
+    which PatternStore evicts patterns by.
+
+    The tables refer to patterns by slot rather than by position: every pattern gets the next slot number when it is
+    added and keeps it, so removing a pattern from the middle of the list doesn't renumber the tables. Slots increase
+    along the list, so a position is found from a slot by bisection, or is the slot itself while nothing was removed.
+
+    Retrievals of a pattern are recorded in a usage record, which copies of the index share as long as neither of them
+    changes the pattern, so that recording a retrieval doesn't need a copy of the index. Likewise, copies share the
+    slots listed under each signature, feature and form until one of them changes them, so a copy only copies the
+    tables themselves rather than everything in them.'''
+
+    def __init__(self, patterns=(), support=None, usage=None):
+        '''
+        :param support - number of experiences learned into each of the patterns, one each if None
+        :param usage - (hits, last_use) pair for each of the patterns, see statistics, or None if they weren't used yet.
+        The times the patterns were last used may come from the use_clock of another process, so they are replaced by
+        current times in the same order.'''
+        self.slots = []  # slot of the pattern at each position, in increasing order
+        self.next_slot = 0
+        self.signatures = []  # signature of the pattern at each position
+        self.positions = {}  # signature -> slots of patterns with that signature, in order
+        self.features = []  # features of the pattern at each position
+        self.postings = {}  # feature -> set of slots of patterns with that feature
+        self.profiles = []  # profile of the pattern at each position, see pattern_profile
+        self.forms = []  # canonical form of the pattern at each position
+        self.identical = {}  # canonical form -> slots of patterns with that form, in order
+        self.made = set()  # (table, key) pairs whose slots this index made, rather than sharing them with a copy
+        self.identities = []  # id() of the pattern at each position
+        self.ids = {}  # id() of a pattern -> its slot
+        self.support = []  # number of experiences learned into the pattern at each position
+        # [number of times retrieved for an inference, use_clock time last learned into or retrieved] for each position
+        self.usage = []
+        self.sizes = []  # estimated memory taken up by the pattern at each position, None until it is needed
+        self.known_size = 0  # sum of the sizes which aren't None
+        self.unsized = set()  # slots of the patterns whose size is None
+        self.heap = None  # eviction candidates, see least_useful; built when it is first needed
+        self.arrays = None  # vectorized.SchemaArrays of the patterns, built by the numpy backend when needed
+        for pattern in patterns:
+            self.append(pattern)
+        if support is not None:
+            self.support = list(support)
+        if usage is not None:
+            for ix in sorted(range(len(usage)), key=lambda ix: usage[ix][1]):
+                self.usage[ix] = [usage[ix][0], next(use_clock)]
+        self.version = next(schema_versions)  # changes whenever the patterns change, see InferenceCache
+
+    def at(self, slot):
+        '''Returns the position of the pattern in the given slot, which must be occupied.'''
+        if len(self.slots) == self.next_slot:  # nothing was removed, so slots and positions are the same
+            return slot
+        return bisect_left(self.slots, slot)
+
+    def occupied(self, slot):
+        '''Returns the position of the pattern in the given slot, or None if the slot is empty.'''
+        ix = self.at(slot)
+        return ix if ix < len(self.slots) and self.slots[ix] == slot else None
+
+    def positions_of(self, slots):
+        if len(self.slots) == self.next_slot:
+            return slots
+        return [bisect_left(self.slots, slot) for slot in slots]
+
+    def writable(self, table, key, empty):
+        '''Returns the slots under key in the named table, ready to be changed. Copies of the index share the slots of
+        every key until one of them changes them, so the slots are copied first unless this index made them.
+        :param empty - type of the slots, list or set'''
+        entries = getattr(self, table)
+        if (table, key) not in self.made:
+            entries[key] = empty(entries.get(key, ()))
+            self.made.add((table, key))
+        return entries[key]
+
+    def discard(self, table, key):
+        del getattr(self, table)[key]
+        self.made.discard((table, key))
+
+    def enter(self, table, key, slot):
+        slots = self.writable(table, key, list)
+        if not slots or slots[-1] < slot:
+            slots.append(slot)
+        else:
+            insort(slots, slot)
+
+    def leave(self, table, key, slot):
+        slots = self.writable(table, key, list)
+        if slots[-1] == slot:
+            slots.pop()
+        else:
+            slots.remove(slot)
+        if not slots:
+            self.discard(table, key)
+
+    def post(self, slot, features):
+        for feature in features:
+            self.writable('postings', feature, set).add(slot)
+
+    def unpost(self, slot, features):
+        for feature in features:
+            postings = self.writable('postings', feature, set)
+            postings.discard(slot)
+            if not postings:
+                self.discard('postings', feature)
+
+    def changed(self):
+        self.arrays = None
+        self.version = next(schema_versions)
+
+    def append(self, pattern, form=None):
+        '''Adds a pattern at the end of the index.
+        :param form - canonical form of the pattern, if it is known already'''
+        slot = self.next_slot
+        self.next_slot += 1
+        self.slots.append(slot)
+        self.insert_pattern(len(self.signatures), slot, pattern, form)
+        self.support.append(1)
+        self.usage.append([0, next(use_clock)])
+        self.sizes.append(None)
+        self.unsized.add(slot)
+        self.prioritize(slot)
+        self.changed()
+
+    def insert_pattern(self, ix, slot, pattern, form=None):
+        signature = pattern_signature(pattern)
+        features = pattern_features(pattern)
+        form = canonical_form(pattern) if form is None else form
+        self.enter('positions', signature, slot)
+        self.post(slot, features)
+        self.enter('identical', form, slot)
+        self.ids.setdefault(id(pattern), slot)
+        self.signatures.insert(ix, signature)
+        self.features.insert(ix, features)
+        self.profiles.insert(ix, pattern_profile(pattern))
+        self.forms.insert(ix, form)
+        self.identities.insert(ix, id(pattern))
+
+    def remove_pattern(self, ix, slot):
+        self.leave('positions', self.signatures.pop(ix), slot)
+        self.unpost(slot, self.features.pop(ix))
+        self.leave('identical', self.forms.pop(ix), slot)
+        self.profiles.pop(ix)
+        identity = self.identities.pop(ix)
+        if self.ids.get(identity) == slot:
+            del self.ids[identity]
+        size = self.sizes.pop(ix)
+        if size is None:
+            self.unsized.discard(slot)
+        else:
+            self.known_size -= size
+        hits, last_use = self.usage.pop(ix)
+        return self.support.pop(ix), hits, last_use, size, slot
+
+    @property
+    def hits(self):
+        '''Number of times the pattern at each position was retrieved for an inference.'''
+        return [usage[0] for usage in self.usage]
+
+    @property
+    def last_use(self):
+        '''use_clock time the pattern at each position was last learned into or retrieved.'''
+        return [usage[1] for usage in self.usage]
+
+    def statistics(self):
+        '''Returns the usage statistics of the patterns, which can be passed to the constructor to build an index with
+        the same statistics, such as in another process.
+        :return tuple (support of each pattern, (hits, last_use) pair of each pattern)'''
+        return list(self.support), [tuple(usage) for usage in self.usage]
+
+    def use(self, ix, hits=0):
+        '''Counts a use of the pattern at position ix, changing its usage record in place, so that copies of the index
+        sharing the record count it too.'''
+        usage = self.usage[ix]
+        usage[0] += hits
+        usage[1] = next(use_clock)
+
+    def detach(self, ix):
+        '''Gives the pattern at position ix its own usage record, before it is changed in this copy of the index.'''
+        self.usage[ix] = list(self.usage[ix])
+
+    def position(self, pattern):
+        '''Returns the position of the given pattern object, or None if it isn't indexed.'''
+        slot = self.ids.get(id(pattern))
+        if slot is None:
+            return None
+        ix = self.occupied(slot)
+        return ix if ix is not None and self.identities[ix] == id(pattern) else None
+
+    def replace(self, ix, pattern):
+        slot = self.slots[ix]
+        self.detach(ix)
+        if self.sizes[ix] is not None:
+            self.known_size -= self.sizes[ix]
+            self.sizes[ix] = None
+            self.unsized.add(slot)
+        if self.ids.get(self.identities[ix]) == slot:
+            del self.ids[self.identities[ix]]
+        self.ids.setdefault(id(pattern), slot)
+        self.identities[ix] = id(pattern)
+        self.profiles[ix] = pattern_profile(pattern)
+        self.changed()
+        form = canonical_form(pattern)
+        if form != self.forms[ix]:
+            self.leave('identical', self.forms[ix], slot)
+            self.enter('identical', form, slot)
+            self.forms[ix] = form
+        features = pattern_features(pattern)
+        if features != self.features[ix]:
+            self.unpost(slot, self.features[ix])
+            self.post(slot, features)
+            self.features[ix] = features
+        signature = pattern_signature(pattern)
+        if signature == self.signatures[ix]:  # the usual case, reconciliation doesn't change the names in a pattern
+            return
+        self.leave('positions', self.signatures[ix], slot)
+        self.enter('positions', signature, slot)
+        self.signatures[ix] = signature
+        self.prioritize(slot)
+
+    def pop(self):
+        '''Removes the last pattern from the index.'''
+        slot = self.slots.pop()
+        self.remove_pattern(len(self.slots), slot)
+        if slot == self.next_slot - 1:  # keeps slots and positions the same after undoing an append
+            self.next_slot -= 1
+        self.changed()
+
+    def remove(self, ix):
+        '''Removes the pattern at position ix from the index, moving the patterns after it up by one.
+        :return the usage statistics and slot of the pattern, to be passed to insert to put it back'''
+        slot = self.slots.pop(ix)
+        statistics = self.remove_pattern(ix, slot)
+        self.changed()
+        return statistics
+
+    def insert(self, ix, pattern, statistics):
+        '''Puts a pattern removed with remove back at position ix, moving the patterns from there on down by one.'''
+        support, hits, last_use, size, slot = statistics
+        self.slots.insert(ix, slot)
+        self.insert_pattern(ix, slot, pattern)
+        self.support.insert(ix, support)
+        self.usage.insert(ix, [hits, last_use])
+        self.sizes.insert(ix, size)
+        if size is None:
+            self.unsized.add(slot)
+        else:
+            self.known_size += size
+        self.prioritize(slot)
+        self.changed()
+
+    def total_size(self, patterns):
+        '''Returns the estimated memory taken up by the given patterns, which must be the indexed ones. Only the sizes
+        of patterns which were added or changed since the last call are estimated.'''
+        for slot in self.unsized:
+            ix = self.at(slot)
+            self.sizes[ix] = estimate_size(patterns[ix])
+            self.known_size += self.sizes[ix]
+        self.unsized = set()
+        return self.known_size
+
+    def is_exception(self, ix):
+        return self.positions[self.signatures[ix]][0] != self.slots[ix]
+
+    def exceptions(self):
+        '''Returns the positions of all patterns which aren't the first with their signature. These were added because
+        they couldn't be reconciled with the first one, which learning always reconciles new experiences with.'''
+        return self.positions_of(sorted([slot for slots in self.positions.values() for slot in slots[1:]]))
+
+    def usefulness(self, ix):
+        '''Returns what patterns are evicted by, least useful first: the number of times the pattern at position ix was
+        learned into or retrieved, then the time it was last used, then its slot, which keeps ties in list order.'''
+        return self.support[ix] + self.usage[ix][0], self.usage[ix][1], self.slots[ix]
+
+    def prioritize(self, slot):
+        '''Makes sure the pattern in the given slot, and the one its signature's first pattern may have become, are
+        candidates for eviction with their current usefulness. Has to be called when a pattern may have become an
+        exception, or when its usefulness decreased; increases are noticed when the pattern comes up for eviction.'''
+        if self.heap is None:
+            return
+        if len(self.heap) > 2 * len(self.slots) + 16:  # mostly entries of patterns which are gone or no exceptions
+            self.heap = None
+            return
+        for candidate in {slot, *self.positions[self.signatures[self.at(slot)]][1:2]}:
+            ix = self.at(candidate)
+            if self.is_exception(ix):
+                heapq.heappush(self.heap, self.usefulness(ix))
+
+    def least_useful(self, keep=None):
+        '''Returns the position of the least useful exception other than the one at position keep, or None if there
+        is none. Exceptions are kept in a heap by their usefulness when they were entered; since patterns only become
+        more useful as they are used, an outdated entry is only entered again once it comes to the top.'''
+        if self.heap is None:
+            self.heap = [self.usefulness(ix) for ix in self.exceptions()]
+            heapq.heapify(self.heap)
+        kept = []
+        found = None
+        while self.heap:
+            entry = self.heap[0]
+            ix = self.occupied(entry[2])
+            if ix is None or not self.is_exception(ix):
+                heapq.heappop(self.heap)
+            elif entry != self.usefulness(ix):
+                heapq.heapreplace(self.heap, self.usefulness(ix))
+            elif ix == keep:
+                kept.append(heapq.heappop(self.heap))
+            else:
+                found = ix
+                break
+        for entry in kept:
+            heapq.heappush(self.heap, entry)
+        return found
+
+    def lookup(self, signature):
+        '''Returns the positions of all patterns with the given signature.'''
+        return self.positions_of(self.positions.get(signature, []))
+
+    def find(self, form):
+        '''Returns the positions of all patterns with the given canonical form.'''
+        return self.positions_of(self.identical.get(form, []))
+
+    def candidates(self, features):
+        '''Returns the positions of all patterns sharing at least one of the given features, in order.'''
+        slots = set()
+        for feature in features:
+            if feature in self.postings:
+                slots.update(self.postings[feature])
+        return self.positions_of(sorted(slots))
+
+    def shares_features(self, features):
+        '''Returns whether any pattern has at least one of the given features.'''
+        return any([feature in self.postings for feature in features])
+
+    def copy(self):
+        index = SchemaIndex()
+        index.slots = list(self.slots)
+        index.next_slot = self.next_slot
+        index.signatures = list(self.signatures)
+        index.positions = dict(self.positions)  # the slots are shared until they are changed, see writable
+        index.features = list(self.features)
+        index.postings = dict(self.postings)
+        index.profiles = list(self.profiles)
+        index.forms = list(self.forms)
+        index.identical = dict(self.identical)
+        index.identities = list(self.identities)
+        index.ids = dict(self.ids)
+        index.support = list(self.support)
+        index.usage = list(self.usage)  # the records themselves are shared, see detach
+        index.sizes = list(self.sizes)
+        index.known_size = self.known_size
+        index.unsized = set(self.unsized)
+        index.heap = None if self.heap is None else list(self.heap)
+        index.arrays = self.arrays  # never changed in place, only replaced
+        index.version = self.version
+        self.made = set()  # the slots are now shared with the copy
+        return index
+
+
+class PatternStore(dict):
+    '''A store of patterns, mapping schema names to lists of patterns. Behaves like the plain dictionaries used
+    throughout, but keeps a SchemaIndex for every schema so that a pattern with a matching signature can be found with a
+    single lookup instead of a scan over the whole list. The lists should only be changed through add and replace, which
+    keep the indices up to date.
+
+    Copies share their lists with the original until one of them changes a schema, at which point only that schema is
+    copied. Changes made after a snapshot are recorded, so that they can be rolled back.
+
+    Adding a pattern which is alpha-equivalent to one stored under the same schema, i.e. identical up to renaming its
+    VariablePlaceholders, counts as support for the stored pattern instead of storing it twice.
+
+    A store can be given a budget for every schema. Once a schema grows past it, the least useful exception patterns
+    are evicted: those learned from and retrieved the fewest times, and of those the ones used the longest time ago.'''
+
+    def __init__(self, *args, max_patterns=None, max_bytes=None, **kwargs):
+        '''
+        :param max_patterns - maximum number of patterns kept per schema, unlimited if None
+        :param max_bytes - maximum estimated memory taken up by the patterns of a schema, unlimited if None'''
+        super(PatternStore, self).__init__(*args, **kwargs)
+        self.indices = {}  # schema name -> SchemaIndex, built on first use
+        self.owned = set()  # names of schemas whose lists aren't shared with any other store or dictionary
+        self.journal = None  # list of changes made since the oldest open snapshot, None if there is no snapshot
+        self.max_patterns = max_patterns
+        self.max_bytes = max_bytes
+        self.evictions = {}  # schema name -> number of patterns evicted from it to keep it within the budget
+
+    def index(self, name):
+        '''Returns the SchemaIndex for the named schema, building it if it doesn't exist yet.'''
+        if name not in self.indices:
+            self.indices[name] = SchemaIndex(self[name])
+        return self.indices[name]
+
+    def own(self, name):
+        '''Makes sure the list of the named schema can be changed without affecting other stores.'''
+        if name in self.owned:
+            return
+        self[name] = list(self[name])
+        if name in self.indices:
+            self.indices[name] = self.indices[name].copy()
+        self.owned.add(name)
+
+    def copy(self):
+        '''Returns a copy of the store. Runs in time proportional to the number of schemas, since the lists are only
+        copied when they are changed.'''
+        store = PatternStore(self, max_patterns=self.max_patterns, max_bytes=self.max_bytes)
+        store.indices = dict(self.indices)
+        store.evictions = dict(self.evictions)
+        self.owned = set()  # the lists are now shared with the copy
+        return store
+
+    def add(self, name, pattern, support=1):
+        '''Appends a pattern to the named schema, creating the schema if necessary, and evicts patterns if the schema
+        grows past the budget. The added pattern itself is kept, so that it gets the chance to be used. If the schema
+        already holds an alpha-equivalent pattern, that one is supported instead.
+        :param support - number of experiences learned into the pattern'''
+        form = canonical_form(pattern)
+        created = name not in self
+        if created:
+            self[name] = []
+            self.owned.add(name)
+        else:
+            positions = self.index(name).find(form)
+            if positions:
+                self.add_support(name, positions[0], support)
+                return
+            self.own(name)
+        pattern = freeze_pattern(pattern)
+        index = self.index(name)
+        index.append(pattern, form)
+        index.support[-1] = support
+        self[name].append(pattern)
+        if self.journal is not None:
+            self.journal.append(('add', name, created))
+        self.enforce_budget(name, len(self[name]) - 1)
+
+    def replace(self, name, ix, pattern):
+        '''Replaces the pattern at position ix of the named schema.'''
+        self.own(name)
+        if self.journal is not None:
+            self.journal.append(('replace', name, ix, self[name][ix]))
+        pattern = freeze_pattern(pattern)
+        self.index(name).replace(ix, pattern)
+        self[name][ix] = pattern
+
+    def add_support(self, name, ix, count=1):
+        '''Counts further experiences as support for the pattern at position ix of the named schema. Doesn't change the
+        pattern itself, so inferences made from the schema stay valid.'''
+        self.own(name)
+        if self.journal is not None:
+            self.journal.append(('support', name, ix, count))
+        index = self.index(name)
+        index.support[ix] += count
+        index.detach(ix)
+        index.use(ix)
+
+    def record_use(self, name, pattern):
+        '''Counts a retrieval of a pattern stored under the named schema, such as for an inference. Like support, this
+        doesn't change the pattern, and isn't undone on rollback. The pattern is found by identity in a single lookup,
+        and the store isn't changed otherwise, so stores sharing the pattern with this one count the retrieval too.'''
+        if name not in self:
+            return
+        index = self.index(name)
+        ix = index.position(pattern)
+        if ix is not None:
+            index.use(ix, 1)
+
+    def find(self, name, pattern):
+        '''Returns the position of the first pattern of the named schema which is alpha-equivalent to the given one, or
+        None if there is none. Takes a single hash lookup.'''
+        if name not in self:
+            return None
+        positions = self.index(name).find(canonical_form(pattern))
+        return positions[0] if positions else None
+
+    def schema_size(self, name):
+        '''Returns the estimated memory taken up by the patterns of the named schema.'''
+        return self.index(name).total_size(self[name])
+
+    def over_budget(self, name):
+        return self.max_patterns is not None and len(self[name]) > self.max_patterns or \
+            self.max_bytes is not None and self.schema_size(name) > self.max_bytes
+
+    def enforce_budget(self, name, keep=None):
+        '''Evicts the least useful exception patterns of the named schema until it is within the budget, or there are no
+        exceptions left to evict. Patterns which aren't exceptions are always kept, since every experience with their
+        signature is learned into them.
+        :param keep - position of a pattern which mustn't be evicted'''
+        while self.over_budget(name):
+            ix = self.index(name).least_useful(keep)
+            if ix is None:
+                return
+            self.evict(name, ix)
+            if keep is not None and keep > ix:
+                keep -= 1
+
+    def evict(self, name, ix):
+        '''Removes the pattern at position ix of the named schema and counts the eviction.'''
+        self.own(name)
+        pattern = self[name].pop(ix)
+        statistics = self.index(name).remove(ix)
+        if self.journal is not None:
+            self.journal.append(('evict', name, ix, pattern, statistics))
+        self.evictions[name] = self.evictions.get(name, 0) + 1
+
+    def support(self, name, ix):
+        '''Returns the number of experiences learned into the pattern at position ix of the named schema. Patterns which
+        were stored without being learned, e.g. loaded or assigned, count as supported by one experience.'''
+        return self.index(name).support[ix]
+
+    def assign(self, name, patterns, support=None, usage=None):
+        '''Replaces all patterns stored under the named schema with the given list, which the store takes over.
+        :param support - number of experiences learned into each of the patterns, one each if None
+        :param usage - (hits, last_use) pair for each of the patterns, see SchemaIndex.statistics'''
+        if self.journal is not None:
+            self.journal.append(('assign', name, self.get(name), self.indices.get(name)))
+        patterns[:] = [freeze_pattern(pattern) for pattern in patterns]
+        self[name] = patterns
+        if support is None and usage is None:
+            self.indices.pop(name, None)  # rebuilt on first use
+        else:
+            self.indices[name] = SchemaIndex(patterns, support, usage)
+        self.owned.add(name)
+
+    def lookup(self, name, signature):
+        '''Returns the positions of patterns with the given signature stored under the named schema.'''
+        if name not in self:
+            return []
+        return self.index(name).lookup(signature)
+
+    def snapshot(self):
+        '''Starts recording changes to the store.
+        :return a token which can be passed to rollback to undo all changes made after this call, or to commit to keep
+        them'''
+        if self.journal is None:
+            self.journal = []
+        return len(self.journal)
+
+    def rollback(self, token):
+        '''Undoes all changes made since the snapshot that returned the token. Takes time proportional to the number of
+        changes undone.'''
+        while len(self.journal) > token:
+            change = self.journal.pop()
+            name = change[1]
+            if change[0] == 'assign':
+                self.indices.pop(name, None)
+                self.owned.discard(name)  # the list may be shared, as it was before it was replaced
+                if change[2] is None:
+                    del self[name]
+                else:
+                    self[name] = change[2]
+                    if change[3] is not None:
+                        self.indices[name] = change[3]
+                continue
+            self.own(name)
+            if change[0] == 'support':
+                index = self.index(name)
+                index.support[change[2]] -= change[3]
+                index.prioritize(index.slots[change[2]])
+            elif change[0] == 'evict':
+                ix, pattern, statistics = change[2:]
+                self[name].insert(ix, pattern)
+                self.index(name).insert(ix, pattern, statistics)
+                self.evictions[name] -= 1
+            elif change[0] == 'add':
+                self[name].pop()
+                self.index(name).pop()
+                if change[2]:  # the schema was created by this change
+                    del self[name]
+                    del self.indices[name]
+                    self.owned.discard(name)
+            else:
+                ix, pattern = change[2], change[3]
+                self.index(name).replace(ix, pattern)
+                self[name][ix] = pattern
+        self.commit(token)
+
+    def commit(self, token):
+        '''Keeps all changes made since the snapshot that returned the token.'''
+        if token == 0:
+            self.journal = None  # there are no snapshots left open
+
+    @contextmanager
+    def transaction(self):
+        '''Context manager which rolls back all changes made within it if an exception is raised.'''
+        token = self.snapshot()
+        try:
+            yield self
+        except BaseException:
+            self.rollback(token)
+            raise
+        self.commit(token)
+
+    def __reduce__(self):  # the indices are keyed by identity, which pickles don't keep, so only statistics are kept
+        statistics = {name: index.statistics() for name, index in self.indices.items()}
+        return restore_store, (dict(self.items()), statistics, self.max_patterns, self.max_bytes, dict(self.evictions))
+
+
+def restore_store(patterns, statistics, max_patterns, max_bytes, evictions):
+    '''Recreates a pickled PatternStore.'''
+    store = PatternStore(patterns, max_patterns=max_patterns, max_bytes=max_bytes)
+    for name in statistics:
+        store.indices[name] = SchemaIndex(patterns[name], *statistics[name])
+    store.evictions = evictions
+    return store
+
+
+def as_pattern_store(pattern_store):
+    '''Wraps a plain dictionary of patterns in a PatternStore, or returns the store itself if it already is one. A
+    dictionary doesn't keep the statistics of its patterns, so every wrapped pattern counts as supported once and
+    unused.'''
+    if isinstance(pattern_store, PatternStore):
+        return pattern_store
+    return PatternStore(pattern_store)
 
 
 def matching_pattern(pattern, name, pattern_store):
-    '''Returns the most similar pattern stored under the named hypothesis'''
+    '''Returns the first pattern stored under the named hypothesis whose signature matches that of the given pattern,
+    along with its index in the store'''
     if name not in pattern_store:  # this category of schemas doesn't exist
         return None, None
-    patterns = pattern_store[name]
+    store = as_pattern_store(pattern_store)
 
-    for ix, candidate_pattern in enumerate(patterns):
-        if propositions_actions_names_match(candidate_pattern, pattern):
-            return ix, candidate_pattern  # return the pattern and its index in the store
+    positions = store.lookup(name, pattern_signature(pattern))
+    if positions:
+        ix = positions[0]
+        return ix, store[name][ix]  # return the pattern and its index in the store
     return None, None  # couldn't find anything
 
 
-def learn(pattern, name, pattern_store):
+def subsumes(general, pattern):
+    '''Tells whether an experience is an instance of a more general pattern: whether the VariablePlaceholders of the
+    general pattern can be bound to the Variables of the experience, one placeholder to one Variable, such that the two
+    agree. Only answers True if reconciling the two with reconcile_patterns would give back the general pattern with new
+    placeholders in place of its own, so that the experience can be counted as support for the general pattern instead
+    of being reconciled with it. When in doubt, e.g. for a general pattern that was never reconciled, answers False.
+    :param general - pattern with placeholders, usually from a store
+    :param pattern - experience made of concrete Variables'''
+    pre_g, act_g, post_g = general
+    pre, act, post = pattern
+    if len(pre_g) != len(pre) or len(post_g) != len(post) or type(act_g) != type(act):
+        return False
+    if act is not None and (len(act_g.vars) != len(act.vars) or tuple(act_g.args) != tuple(act_g.vars)):
+        return False  # reconciliation rebuilds the Action from its variables, so it would differ from this one
+    terms = [arg for prop in pre + post for arg in prop.arguments] + (list(act.vars) if act is not None else [])
+    if any([type(term) != Variable for term in terms]):
+        return False
+    bindings = {}  # placeholder of the general pattern -> Variable of the experience
+    bound = {}  # Variable of the experience -> placeholder bound to it
+
+    def bind(general_terms, terms, position):
+        # reconciliation only takes the substitutions made for a Proposition or Action into account after it, so new
+        # bindings are collected separately until then
+        new = {}
+        for ix, (term_g, term) in enumerate(zip(general_terms, terms)):
+            if type(term_g) != VariablePlaceholder:
+                if term_g != term or term in bound:
+                    return False
+            elif term_g in bindings:
+                if bindings[term_g] != term:
+                    return False
+            elif term_g in new or term in bound or term in new.values() or term_g.held_variable is not None \
+                    or term_g.position != position(ix):  # a new placeholder would take the place of this one
+                return False
+            else:
+                new[term_g] = term
+        bindings.update(new)
+        bound.update([(term, term_g) for term_g, term in new.items()])
+        return True
+
+    pre_pairs = align_prop_lists(pre_g, pre)
+    if pre_pairs == (None, None):
+        return False
+    for prop_g, prop in pre_pairs:
+        if not bind(prop_g.arguments, prop.arguments, lambda ix: ix):
+            return False
+    if act is not None and not bind(act_g.vars, act.vars, lambda ix: None):
+        return False
+    # the post-conditions are aligned after substituting the bound Variables, so they are aligned against the experience
+    # with its bound Variables replaced by their placeholders, which rates every pair the same way
+    views = [Proposition(prop.name, [bound.get(arg, arg) for arg in prop.arguments]) for prop in post]
+    post_pairs = align_prop_lists(post_g, views)
+    if post_pairs == (None, None):
+        return False
+    return all([prop_g == view for prop_g, view in post_pairs])
+
+
+def learn(pattern, name, pattern_store, inplace=False):
     '''Learns by either updating an existing pattern or creating a new one in the pattern store. Currently uses a
     simplified logic in which every non-matching length of pre- or post-conditions is an exception.
+    :param inplace - if True, pattern_store has to be a PatternStore, which is changed and returned. Otherwise, the
+    given store is left as it was and a changed copy is returned. The copy shares the unchanged parts of the learned
+    schema's index, but still copies its pattern list and the tables it keeps per pattern, so that learning many
+    experiences one at a time is better done in place, within a snapshot if the changes may have to be undone.
     '''
     if pattern == ([], None, []):
         return pattern_store
-    store = deepcopy(pattern_store)
+    if inplace:
+        if not isinstance(pattern_store, PatternStore):
+            raise Exception('Only PatternStores can be learned into in place')
+        store = pattern_store
+    else:
+        store = as_pattern_store(pattern_store).copy()
     if name not in store:  # if this is a completely new concept, it can just be added as-is
-        store[name] = [pattern]
+        store.add(name, pattern)
     else:  # otherwise, find if a matching pattern exists
         ix, existing_pattern = matching_pattern(pattern, name, store)
         if existing_pattern is None:  # this is a novel pattern for this schema, append it to existing ones
-            store[name].append(pattern)
+            store.add(name, pattern)
+        elif subsumes(existing_pattern, pattern):  # already covered, reconciling would give the same pattern back
+            store.add_support(name, ix)
         else:  # there already exists a matching pattern, see if we can reconcile it
             reconciled = reconcile_patterns(existing_pattern, pattern)
             if reconciled == (None, None):  # not possible, need to make an exception
-                store[name].append(pattern)
+                store.add(name, pattern)
             else:  # reconciliation successful, replace the old pattern with the new one
-                store[name][ix] = reconciled[0]
+                store.replace(name, ix, reconciled[0])
+                store.add_support(name, ix)
     return store
 
 
-def most_similar_pattern(pattern, pattern_store):
+def experience_key(pattern):
+    '''Computes a hashable key for a pattern, such that two patterns have the same key only if they are exactly
+    equal.'''
+    pre, act, post = pattern
+    act_key = (type(act), act.command_template, tuple(act.args), tuple(act.vars)) if act is not None else None
+    return tuple(pre), act_key, tuple(post)
+
+
+def learn_many(experiences, name, pattern_store, inplace=False):
+    '''Learns from a sequence of experiences, with the same result as calling learn on each of them in turn: the same
+    patterns, support and usage, and the same evictions if the store has a budget. The store is copied at most once,
+    instead of once per experience, and the matching pattern of every experience is found with a single lookup. An
+    experience which was already found to be covered by, or irreconcilable with, its matching pattern isn't checked
+    again as long as that pattern is unchanged, since the outcome would be the same. Experiences which changed the
+    pattern are checked again, since the changed pattern need not cover them.
+    :param experiences - iterable of patterns of the form ([Proposition...], Action, [Proposition])
+    :param inplace - if True, pattern_store has to be a PatternStore, which is changed and returned. Otherwise, the
+    given store is left as it was and a changed copy is returned.'''
+    if inplace:
+        if not isinstance(pattern_store, PatternStore):
+            raise Exception('Only PatternStores can be learned into in place')
+        store = pattern_store
+    else:
+        store = as_pattern_store(pattern_store).copy()
+
+    outcomes = {}  # experience key -> (matching pattern it was checked against, whether it was an exception)
+    for pattern in experiences:
+        if pattern == ([], None, []):
+            continue
+        positions = store.lookup(name, pattern_signature(pattern))
+        if not positions:  # a novel pattern for this schema
+            store.add(name, pattern)
+            continue
+        ix = positions[0]
+        head = store[name][ix]
+        key = experience_key(pattern)
+        if key in outcomes and outcomes[key][0] is head:  # the pattern is unchanged since this was checked
+            exception = outcomes[key][1]
+        elif subsumes(head, pattern):  # already covered, reconciling would give the same pattern back
+            exception = False
+            outcomes[key] = (head, exception)
+        else:
+            reconciled = reconcile_patterns(head, pattern)
+            exception = reconciled == (None, None)
+            if exception:  # not possible, need to make an exception
+                outcomes[key] = (head, exception)
+            else:
+                store.replace(name, ix, reconciled[0])
+        if exception:
+            store.add(name, pattern)
+        else:
+            store.add_support(name, ix)
+    return store
+
+
+def generalize(experiences):
+    '''Computes the least general generalization of a group of experiences in one pass, instead of reconciling them one
+    at a time. The Propositions of every experience are aligned with those of the first one, so that each argument
+    position of the group holds one term from each experience. Positions holding the same term in every experience keep
+    it; every distinct column of terms is replaced by a single VariablePlaceholder, shared wherever that column occurs.
+    Placeholders are made like reconcile_patterns makes them: with the position of the argument they first occur at in
+    the pre-conditions, or without a position if they first occur in the Action.
+    :param experiences - list of patterns with the same signature
+    :return the generalized pattern, or None if the experiences have different signatures, can't be aligned, or their
+    post-conditions vary in ways the pre-conditions and Actions don't account for'''
+    if not experiences:
+        return None
+    first = experiences[0]
+    if any([pattern_signature(pattern) != pattern_signature(first) for pattern in experiences]):
+        return None
+    columns = {}  # tuple of the terms at an argument position in every experience -> term of the generalization
+
+    def generalize_column(column, position, introduce):
+        if column in columns:
+            return columns[column]
+        if all([term == column[0] for term in column]):
+            return column[0]
+        if not introduce:
+            return None
+        columns[column] = VariablePlaceholder(position=position)
+        return columns[column]
+
+    def generalize_props(props, side, introduce):
+        alignments = []  # Propositions of each experience, in the order of the first experience's Propositions
+        for pattern in experiences:
+            pairs = align_prop_lists(props, pattern[side])
+            if pairs == (None, None):
+                return None
+            alignments.append([match for _, match in pairs])
+        generalized = []
+        for prop, matches in zip(props, zip(*alignments)):
+            args = []
+            for ix in range(len(prop.arguments)):
+                arg = generalize_column(tuple([match.arguments[ix] for match in matches]), ix, introduce)
+                if arg is None:
+                    return None
+                args.append(arg)
+            generalized.append(Proposition(prop.name, args))
+        return generalized
+
+    pre = generalize_props(first[0], 0, True)
+    if pre is None:
+        return None
+    act = first[1]
+    if act is not None:
+        if any([len(pattern[1].vars) != len(act.vars) for pattern in experiences]):
+            return None
+        act = type(act)(*[generalize_column(tuple([pattern[1].vars[ix] for pattern in experiences]), None, True)
+                          for ix in range(len(act.vars))])
+    post = generalize_props(first[2], 2, False)  # new placeholders in post-conditions would make it an exception
+    if post is None:
+        return None
+    return pre, act, post
+
+
+def admissible_signature(pattern):
+    '''Computes the requirements a candidate's signature has to meet to be scored against the given pattern in
+    most_similar_pattern: every pre- and post-condition name needs a counterpart in the candidate, and the action needs to
+    be of the same type, unless it is None.'''
+    pre, act, post = pattern
+    return frozenset([p.name for p in pre]), type(act) if act is not None else None, frozenset([p.name for p in post])
+
+
+def signature_is_admissible(signature, requirements):
+    pre_names, act_type, post_names = requirements
+    return pre_names.issubset(signature[0]) and (act_type is None or act_type == signature[1]) and \
+           post_names.issubset(signature[2])
+
+
+def score_bounds(pattern, profile):
+    '''Computes upper bounds on the ratings a candidate with the given profile (see pattern_profile) can get for each
+    part of the given pattern in score_candidate. An argument of a Proposition can only be rated +1 if it is a
+    placeholder on both sides or concrete on both sides, and an Action variable at most +1.
+    :return list of bounds for the pre-propositions, the action and the post-propositions in the order they are scored,
+    or None if the candidate can't be compared with the pattern'''
+    pre, act, post = pattern
+    act_type, act_vars, props = profile
+    bounds = []
+    for side, side_props in ((0, pre), (None, None), (2, post)):
+        if side is None:
+            if type(act) == act_type:
+                bounds.append(1 + (min(len(act.vars), act_vars) if isinstance(act, agent.Action) else 0))
+            elif act is not None:
+                return None
+            else:
+                bounds.append(0)
+            continue
+        for prop in side_props:
+            mask = placeholder_mask(prop)
+            agreements = [sum([a == b for a, b in zip(mask, c_mask)]) for c_side, c_name, c_arity, c_mask in props
+                          if c_side == side and c_name == prop.name and c_arity == len(mask)]
+            if not agreements:
+                return None
+            bounds.append(max(agreements))
+    return bounds
+
+
+def score_candidate(pattern, candidate, bounds=None, threshold=None):
+    '''Scores the similarity of a stored candidate pattern to the given pattern, as the sum of the ratings of the
+    best matching Propositions and a rating of the actions.
+    :param bounds - upper bounds on the rating of each part of the pattern, as computed by score_bounds
+    :param threshold - score the candidate needs to exceed; scoring stops as soon as the bounds show it can't
+    :return the score, or None if the candidate can't be compared with the pattern or can't exceed the threshold'''
+    pre, act, post = pattern
+    ceiling = sum(bounds) if bounds is not None else None  # best score the candidate can still get
+    if threshold is not None and ceiling <= threshold:
+        return None
+    part = 0
+    total_score = 0
+    # score every proposition in pre-propositions
+    for prop in pre:
+        _, score = match_propositions(prop, candidate[0])
+        if score is None:
+            return None
+        total_score += score
+        if threshold is not None:
+            ceiling -= bounds[part] - score
+            if ceiling <= threshold:
+                return None
+        part += 1
+
+    # score the action
+    act_score = 0
+    if type(act) == type(candidate[1]):
+        act_score += 1
+        if isinstance(act, agent.Action) and isinstance(candidate[1], agent.Action):
+            for var1, var2 in zip(act.vars, candidate[1].vars):
+                if var1 == var2:
+                    act_score += 1
+                elif not (isinstance(var1, VariablePlaceholder) and isinstance(var2, VariablePlaceholder)):
+                    act_score -= 1
+    elif act is not None:  # scoring is possible for action mismatch only if the action is None
+        # this is the case when the action was left empty in order to infer what actions are possible
+        # i.e. pattern is of type (..., None, ...) - pre- or post-conditions are given, but the action not.
+        # In all other cases, the pattern should not be considered, because inference between two different
+        # actions is impossible. e.g. Take(object, container) can't be compared to Go(north)
+        return None
+    total_score += act_score
+    if threshold is not None:
+        ceiling -= bounds[part] - act_score
+        if ceiling <= threshold:
+            return None
+    part += 1
+
+    # score every proposition in post-propositions
+    for prop in post:
+        _, score = match_propositions(prop, candidate[2])
+        if score is None:
+            return None
+        total_score += score
+        if threshold is not None:
+            ceiling -= bounds[part] - score
+            if ceiling <= threshold:
+                return None
+        part += 1
+    return total_score
+
+
+def most_similar_pattern(pattern, pattern_store, top_k=1, backend='python'):
     '''Returns the name of the image schema as well as the pattern that best matches the given input pattern.
     :param pattern - a pattern of the form ([Proposition...], Action, [Proposition])
     :param pattern_store - a store of patterns
+    :param top_k - number of best matching patterns to return
+    :param backend - 'python' to score candidates one by one, or 'numpy' to score all patterns of a schema at once with
+    the vectorized module, which gives the same results and is faster on large stores
     :return tuple (matched pattern, name, score) specifying the pattern found, the name of it and the score it was
-    assigned, or (None, None, None) if no patterns could be matched.'''
-    if len(pattern_store) == 0:
-        return None, None, None
-    elif pattern == ([], None, []):
-        return None, None, None
-    else:
-        ranking = []
-        pre, act, post = pattern
-        for schema_name in pattern_store:
-            for candidate in pattern_store[schema_name]:
-                pre_candidate, post_candidate = deepcopy(candidate[0]), deepcopy(candidate[2])
-                total_score = 0
-                # score every proposition in pre-propositions
-                for prop in pre:
-                    _, score = match_propositions(prop, pre_candidate)
-                    if score is not None:
-                        total_score += score
-                    else:
-                        break
-                if pre and score is None:
-                    continue
-
-                # score the action
-                if type(act) == type(candidate[1]):
-                    total_score += 1
-                    if isinstance(act, agent.Action) and isinstance(candidate[1], agent.Action):
-                        for var1, var2 in zip(act.vars, candidate[1].vars):
-                            if var1 == var2:
-                                total_score += 1
-                            elif not (isinstance(var1, VariablePlaceholder) and isinstance(var2, VariablePlaceholder)):
-                                total_score -= 1
-                elif act is not None:  # scoring is possible for action mismatch only if the action is None
-                    # this is the case when the action was left empty in order to infer what actions are possible
-                    # i.e. pattern is of type (..., None, ...) - pre- or post-conditions are given, but the action not.
-                    # In all other cases, the pattern should not be considered, because inference between two different
-                    # actions is impossible. e.g. Take(object, container) can't be compared to Go(north)
-                    continue
-
-                # score every proposition in post-propositions
-                for prop in post:
-                    _, score = match_propositions(prop, post_candidate)
-                    if score is not None:
-                        total_score += score
-                    else:
-                        break
-                if post and score is None:  # go to next candidate in case an error occurred anywhere
-                    continue
+    assigned, or (None, None, None) if no patterns could be matched. If top_k is more than 1, a list of up to top_k such
+    tuples is returned instead, best first. Patterns with equal scores are ranked in the order they are stored.'''
+    if top_k < 1:
+        raise ValueError('top_k must be at least 1, not %s' % top_k)
+    if backend == 'numpy':
+        import vectorized  # imported here, so that numpy is only needed when it is used
+        return vectorized.most_similar_pattern(pattern, pattern_store, top_k)
+    elif backend != 'python':
+        raise Exception('Unknown backend %s' % backend)
+    nothing = (None, None, None) if top_k == 1 else []
+    if len(pattern_store) == 0 or pattern == ([], None, []):
+        return nothing
+
+    best = None  # (candidate, schema_name, score) of the best pattern so far, if only the best one is needed
+    heap = []  # (score, -order, candidate, schema_name) of the top_k best patterns so far, worst first
+    order = 0  # number of patterns scored so far, used to rank patterns with equal scores
+    store = as_pattern_store(pattern_store)
+    requirements = admissible_signature(pattern)
+    admissible = {}  # signature -> whether patterns with it can be scored at all
+    bounds = {}  # profile -> bounds on the ratings of candidates with that profile
+    features = pattern_features(pattern)
+    for schema_name in store:
+        index = store.index(schema_name)
+        patterns = store[schema_name]
+        # only patterns sharing a proposition name, action type or variable with the query can be scored
+        for ix in index.candidates(features):
+            candidate, signature, profile = patterns[ix], index.signatures[ix], index.profiles[ix]
+            if signature not in admissible:
+                admissible[signature] = signature_is_admissible(signature, requirements)
+            if not admissible[signature]:
+                continue  # a proposition or the action is sure to have no counterpart in this candidate
+            if profile not in bounds:
+                bounds[profile] = score_bounds(pattern, profile)
+            if bounds[profile] is None:
+                continue
+            # a candidate has to score higher than the best one so far, or than the worst one kept if top_k are kept
+            if top_k == 1:
+                threshold = None if best is None else best[2]
+            else:
+                threshold = None if len(heap) < top_k else heap[0][0]
+            score = score_candidate(pattern, candidate, bounds[profile], threshold)
+            if score is None:
+                continue
+            if top_k == 1:
+                if best is None or score > best[2]:
+                    best = (candidate, schema_name, score)
+            else:
+                entry = (score, -order, candidate, schema_name)
+                if len(heap) < top_k:
+                    heapq.heappush(heap, entry)
+                elif entry[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, entry)
+                order += 1
+
+    if top_k == 1:
+        return nothing if best is None else best
+    return [(candidate, schema_name, score) for score, _, candidate, schema_name in sorted(heap, reverse=True)]
+
+
+class BoundPattern:
+    '''Pattern with some of its VariablePlaceholders bound to Variables, as inferred by infer. The pattern itself is
+    left as it is; the pattern with those placeholders holding their Variables is only built when it is accessed, with
+    materialize or by indexing, and then behaves like the usual (pre, action, post) tuple.'''
+    __slots__ = ('pattern', 'bindings', 'materialized')
+
+    def __init__(self, pattern, bindings):
+        '''
+        :param pattern - the pattern the placeholders occur in
+        :param bindings - id() of a placeholder -> (placeholder, Variable bound to it)'''
+        self.pattern = pattern
+        self.bindings = bindings
+        self.materialized = None
+
+    def materialize(self):
+        '''Builds the pattern with copies of the bound placeholders, holding their Variables. Propositions and Actions
+        without bound placeholders are taken over from the pattern, and a placeholder shared in the pattern stays
+        shared.'''
+        if self.materialized is not None:
+            return self.materialized
+        copies = {}  # id() of a bound placeholder -> its copy
+
+        def bound(term):
+            if id(term) not in self.bindings:
+                return term
+            if id(term) not in copies:
+                placeholder, var = self.bindings[id(term)]
+                copies[id(term)] = VariablePlaceholder(var, placeholder.position, placeholder.id)
+            return copies[id(term)]
+
+        def bound_props(props):
+            bound_list = []
+            for prop in props:
+                if any([id(arg) in self.bindings for arg in prop.arguments]):
+                    # copied rather than constructed, since textworld would hand back the memoised unbound Proposition
+                    prop = copy(prop)
+                    prop.arguments = tuple([bound(arg) for arg in prop.arguments])
+                bound_list.append(prop)
+            return bound_list
+
+        pre, act, post = self.pattern
+        if act is not None and any([id(var) in self.bindings for var in act.vars]):
+            act = copy(act)  # keeps the command text of the unbound action, as filling placeholders did before
+            act.args = tuple([bound(arg) for arg in act.args])
+            act.vars = [bound(var) for var in act.vars]
+        self.materialized = (bound_props(pre), act, bound_props(post))
+        return self.materialized
+
+    def __getitem__(self, ix):
+        return self.materialize()[ix]
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __len__(self):
+        return 3
+
+    def __eq__(self, other):
+        if isinstance(other, BoundPattern):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __ne__(self, other):
+        return not self == other
 
-                # store the candidate, schema_name, score (sum of prop and action similarity scores in the ranking list)
-                ranking.append((candidate, schema_name, total_score))
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def __reduce__(self):  # the bindings are keyed by identity, which copies and pickles don't keep
+        return bind_pattern, (self.pattern, list(self.bindings.values()))
 
-    if len(ranking) == 0:
-        return None, None, None  # couldn't find any matching patterns
-    # return the most fitting entry based on the score key
-    return sorted(ranking, key=lambda x: x[2], reverse=True)[0]
+
+def bind_pattern(pattern, bindings):
+    '''Creates a BoundPattern from a list of (placeholder, Variable) bindings of placeholders in the pattern.'''
+    return BoundPattern(pattern, {id(placeholder): (placeholder, var) for placeholder, var in bindings})
 
 
 def infer(pat_target, pat_source):
@@ -487,26 +1705,32 @@ def infer(pat_target, pat_source):
     variables agree, or the variables from source can be lined up with variable placeholders in target. If so, returns
     the pattern with the substituted variables, with the post-conditions being the inferred results. If the substitution
     is possible, returns the filled in pattern and a substitution dictionary. If it isn't possible, returns None, None.
+    The target is never changed: the filled in pattern is a BoundPattern, which only builds the filled in copy of the
+    target when it is accessed.
     :param pat_target the target to substitute into, presumably from the existing storage of patterns
     :param pat_source the source pattern to take variables from, presumably a new hypothetical scenario we're trying to
     predict consequences of
     :return tuple (pattern, dict) of pattern filled in and a dictionary of substitutions made or None, None if the
     patterns couldn't be made to agree (no inference could have been made)'''
+    bindings = {}  # id() of a placeholder in the target -> (placeholder, Variable it is bound to)
+
+    def bind(placeholder, var):
+        if type(var) != Variable:
+            raise Exception('VariablePlaceholders can only hold instances of Variables')
+        bindings[id(placeholder)] = (placeholder, var)
 
     def merge_props(aligned_props):  # helper function to merge two props lists
         for prop_t, prop_s in aligned_props:
             for var_t, var_s in zip(prop_t.arguments, prop_s.arguments):
                 if isinstance(var_t, VariablePlaceholder):
-                    subs_dict[var_t] = var_s
-                    var_t.fill(var_s)
+                    bind(var_t, var_s)
                 elif var_t != var_s:
                     return None, None
 
-    pre_target, act_target, post_target = deepcopy(pat_target)
+    pre_target, act_target, post_target = pat_target
     pre_source, act_source, post_source = pat_source
 
     aligned_props_pre = align_prop_lists(pre_target, pre_source)
-    subs_dict = {}
     if not aligned_props_pre and (pre_target or pre_source):  # no inferences can be made if props can't be aligned
         return None, None
     else:
@@ -522,13 +1746,13 @@ def infer(pat_target, pat_source):
             return None, None  # can't infer because one action takes more arguments than other
         for var_t, var_s in zip(act_target.vars, act_source.vars):
             if isinstance(var_t, VariablePlaceholder):
-                if var_t.held_variable:
-                    if var_t.held_variable != var_s:
+                held_variable = bindings[id(var_t)][1] if id(var_t) in bindings else var_t.held_variable
+                if held_variable:
+                    if held_variable != var_s:
                         # can't infer because of a mismatch between action arguments and known pattern actin arguments
                         return None, None
                 else:
-                    subs_dict[var_t] = var_s
-                    var_t.fill(var_s)
+                    bind(var_t, var_s)
 
     aligned_props_post = align_prop_lists(post_target, post_source)  # in case the query is about causes
     if not aligned_props_post and (post_target or post_source):
@@ -538,23 +1762,250 @@ def infer(pat_target, pat_source):
             if merge_props(aligned_props_post) == (None, None):
                 return None, None
 
-    return (pre_target, act_target, post_target), subs_dict
+    return BoundPattern(pat_target, bindings), {placeholder: var for placeholder, var in bindings.values()}
 
 
-def make_inference(pattern, pat_store):
+def make_inference(pattern, pat_store, backend='python', cache=None):
     '''Infer from a given pattern and knowledge base of patterns.
     :param pattern Experience pattern with parts to be inferred (pre-conditions, action, or post-conditions) omitted.
     :param pat_store Store of patterns which will be searched to find the right pattern and use it for inference against
      the given one.
+    :param backend Backend used to find the most similar pattern, see most_similar_pattern.
+    :param cache InferenceCache to look the result up in before making the inference, and to keep it in afterwards.
+    Only PatternStores can be cached against, see InferenceCache.
     :return ((Inference, Substitutions), Match, Schema, Score) 4-tuple of: a tuple of filled-in inference pattern with
     substitutions, a matched pattern in the pattern store,the schema name under which the pattern was classified,
-    and similarity score, or all None if no match could be found.'''
-    matched, name, score = most_similar_pattern(pattern, pat_store)
+    and similarity score, or all None if no match could be found. The matched pattern is counted as used, see
+    PatternStore.record_use.'''
+    if cache is not None:
+        store = cache.check_store(pat_store)
+        result = cache.get(pattern, store)
+        if result is None:
+            result = make_inference(pattern, store, backend)
+            cache.put(pattern, store, result)
+        elif result[1] is not None:
+            store.record_use(result[2], result[1])
+        return result
+    store = as_pattern_store(pat_store)
+    matched, name, score = most_similar_pattern(pattern, store, backend=backend)
     if matched is None:
         return None, None, None, None
     inference, subs = infer(matched, pattern)
     if inference is None:
         return None, None, None, None
     else:
+        store.record_use(name, matched)
         return (inference, subs), matched, name, score
-    return None, None, None, None
\ No newline at end of file
+    return None, None, None, None
+
+
+def prepare_store(pat_store, backend='python'):
+    '''Computes everything make_inference needs per store up front: the index of every schema and, for the numpy
+    backend, the arrays every schema is encoded into.
+    :return PatternStore which can be queried repeatedly without repeating that work'''
+    store = as_pattern_store(pat_store)
+    for name in store:
+        store.index(name)
+    if backend == 'numpy':
+        import vectorized
+        for name in store:
+            vectorized.schema_arrays(store, name)
+    return store
+
+
+batch_store = None  # store prepared by init_batch_worker, shared by all chunks a worker process handles
+
+
+def init_batch_worker(pat_store, backend):
+    global batch_store
+    batch_store = prepare_store(pat_store, backend)
+
+
+def make_inference_chunk(patterns, backend):
+    return [make_inference(pattern, batch_store, backend) for pattern in patterns]
+
+
+def make_inference_batch(patterns, pat_store, backend='python', processes=None, chunk_size=64, cache=None):
+    '''Makes inferences for many patterns against the same store, preparing the store only once for all of them.
+    :param patterns List of patterns to infer from, see make_inference.
+    :param pat_store Store of patterns used for all inferences.
+    :param backend Backend used to find the most similar patterns, see most_similar_pattern.
+    :param processes Number of worker processes to spread the patterns over in chunks; the store is sent to each worker
+    once. By default all inferences are made in this process.
+    :param chunk_size Number of patterns handed to a worker process at a time.
+    :param cache InferenceCache used when the inferences are made in this process.
+    :return list of the results of make_inference, in the order of the given patterns'''
+    store = prepare_store(pat_store, backend)
+    if not processes:
+        return [make_inference(pattern, store, backend, cache) for pattern in patterns]
+    chunks = [patterns[ix:ix + chunk_size] for ix in range(0, len(patterns), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_batch_worker,
+                             initargs=(store, backend)) as executor:
+        for chunk in executor.map(make_inference_chunk, chunks, [backend] * len(chunks)):  # map keeps the order
+            results.extend(chunk)
+    return results
+
+
+def canonical_term(term, placeholders, positions=False):
+    if type(term) == VariablePlaceholder:
+        # placeholders are numbered in the order they appear, so queries differing only in placeholders are the same
+        number = placeholders.setdefault(term, len(placeholders))
+        held_variable = canonical_term(term.held_variable, placeholders, positions)
+        if positions:
+            return 'placeholder', number, term.position, held_variable
+        return 'placeholder', number, held_variable
+    elif type(term) == Variable:
+        return 'variable', term.name, term.type
+    return 'value', term
+
+
+def canonical_pattern(pattern, positions):
+    pre, act, post = pattern
+    placeholders = {}
+
+    def props_key(props):
+        return tuple([(prop.name, tuple([canonical_term(arg, placeholders, positions) for arg in prop.arguments]))
+                      for prop in props])
+
+    pre_key = props_key(pre)
+    act_key = None
+    if act is not None:
+        act_key = type(act), tuple([canonical_term(arg, placeholders, positions) for arg in act.args]), \
+                  tuple([canonical_term(var, placeholders, positions) for var in act.vars])
+        if positions:
+            act_key += (act.command_template,)
+    return pre_key, act_key, props_key(post)
+
+
+def query_key(pattern):
+    '''Computes a canonical, hashable form of a query pattern, made of the names of its Propositions, the type and
+    arguments of its Action, and the names and types of the Variables in both. VariablePlaceholders are replaced by
+    their position of first appearance.'''
+    return canonical_pattern(pattern, False)
+
+
+def canonical_form(pattern):
+    '''Computes the canonical form of a pattern, which two patterns share exactly when they are alpha-equivalent: when
+    they only differ in which VariablePlaceholders they use, while sharing them alike. Unlike query_key, this also tells
+    apart placeholders with different positions, since reconciliation treats those differently.
+    :return hashable tuple, in which placeholders are numbered by their first occurrence'''
+    return canonical_pattern(pattern, True)
+
+
+def canonical_hash(pattern):
+    '''Hashes a pattern such that alpha-equivalent patterns get the same hash, see canonical_form.'''
+    return hash(canonical_form(pattern))
+
+
+def estimate_size(obj, seen=None):
+    '''Estimates the memory taken up by a result of make_inference, counting shared objects once.'''
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum([estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items()])
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum([estimate_size(o, seen) for o in obj])
+    elif isinstance(obj, Proposition):
+        size += estimate_size(obj.name, seen) + estimate_size(obj.arguments, seen)
+    elif isinstance(obj, agent.Action):
+        size += estimate_size(obj.args, seen) + estimate_size(obj.vars, seen)
+    elif isinstance(obj, VariablePlaceholder):
+        size += estimate_size(obj.held_variable, seen)
+    elif isinstance(obj, BoundPattern):
+        size += estimate_size(obj.bindings, seen) + estimate_size(obj.materialized, seen)
+    return size
+
+
+class InferenceCache:
+    '''Least recently used cache of the results of make_inference, keyed by the canonical form of the query (see
+    query_key), so queries that only differ in their placeholders share a result.
+
+    Every entry remembers the version of each schema of the store it was computed from, and whether the schema had any
+    pattern sharing a feature with the query. A result is only used again if every schema that changed since then
+    neither had nor has such patterns, since only those can be matched. As learning changes the version of the schemas
+    it changes, it invalidates exactly the entries it could affect. Entries are checked when they are looked up.
+
+    Cached results are shared between all lookups and must not be changed.
+
+    The versions of schemas are kept by PatternStores, so only PatternStores can be cached against. A plain dictionary
+    gets a new PatternStore wrapped around it every time it is queried, with new versions that would never match.'''
+
+    def __init__(self, max_entries=1024, max_bytes=None):
+        '''
+        :param max_entries - maximum number of results kept
+        :param max_bytes - maximum estimated memory taken up by the results kept, unlimited if None'''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # query key -> (result, features, {schema name: (version, relevant)}, size)
+        self.size = 0  # estimated memory taken up by all entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # entries removed to make room for others
+        self.invalidations = 0  # entries removed because the store changed
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def check_store(pat_store):
+        if not isinstance(pat_store, PatternStore):
+            raise Exception('Only PatternStores can be cached against, not %s' % type(pat_store).__name__)
+        return pat_store
+
+    def is_valid(self, entry, store):
+        _, features, schemas, _ = entry
+        for name in store:
+            index = store.index(name)
+            version, relevant = schemas.get(name, (None, False))
+            if version != index.version and (relevant or index.shares_features(features)):
+                return False
+        return not any([relevant and name not in store for name, (_, relevant) in schemas.items()])
+
+    def get(self, pattern, pat_store):
+        '''Returns the cached result of make_inference for the pattern, or None if it isn't cached or the store has
+        changed in a way that could change the result.'''
+        store = self.check_store(pat_store)
+        key = query_key(pattern)
+        entry = self.entries.get(key)
+        if entry is not None and not self.is_valid(entry, store):
+            self.remove(key)
+            self.invalidations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, pattern, pat_store, result):
+        '''Caches the result of make_inference for the pattern and store, evicting the least recently used results
+        while the cache is too large.'''
+        store = self.check_store(pat_store)
+        key = query_key(pattern)
+        if key in self.entries:
+            self.remove(key)
+        features = pattern_features(pattern)
+        schemas = {}
+        for name in store:
+            index = store.index(name)
+            schemas[name] = (index.version, index.shares_features(features))
+        size = estimate_size(key) + estimate_size(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # would push out everything else
+        self.entries[key] = (result, features, schemas, size)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.max_bytes is not None and self.size > self.max_bytes:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        self.size -= self.entries.pop(key)[3]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
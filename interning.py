@@ -0,0 +1,66 @@
+from textworld.logic import Variable
+
+
+class InternedFacts(tuple):
+    '''Tuple of canonical Propositions returned by Interner.facts. Two fact tuples from the same Interner are equal
+    exactly when they are the same object, so they are compared by identity instead of element by element.'''
+
+    def __new__(cls, props, interner):
+        facts = super(InternedFacts, cls).__new__(cls, props)
+        facts.interner = interner
+        facts._hash = tuple.__hash__(facts)
+        return facts
+
+    def __eq__(self, other):
+        if type(other) == InternedFacts and other.interner is self.interner:
+            return self is other
+        return tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):  # the interner isn't pickled along, so unpickled facts are ordinary tuples
+        return tuple, (tuple(self),)
+
+
+class Interner:
+    '''Hash-consing table for Variables, Propositions and lists of facts. Equal objects passed in come back as a single
+    canonical object, so that repeated facts are only kept in memory once and comparing canonical objects mostly comes
+    down to comparing identities.
+
+    Propositions holding VariablePlaceholders are returned unchanged, since placeholders can still be filled, which
+    changes what they are equal to.'''
+
+    def __init__(self):
+        self.variables = {}
+        self.propositions = {}
+        self.fact_tuples = {}  # tuple of canonical Propositions -> InternedFacts
+
+    def __len__(self):
+        return len(self.variables) + len(self.propositions) + len(self.fact_tuples)
+
+    def variable(self, var):
+        '''Returns the canonical object for a Variable; any other argument is returned unchanged.'''
+        if type(var) != Variable:
+            return var
+        return self.variables.setdefault(var, var)
+
+    def proposition(self, prop):
+        '''Returns the canonical object for a Proposition. textworld already shares the Propositions it constructs,
+        but not those that were unpickled, e.g. when they come from another process.'''
+        if any([type(arg) != Variable for arg in prop.arguments]):
+            return prop
+        return self.propositions.setdefault(prop, prop)
+
+    def facts(self, facts):
+        '''Returns the canonical tuple for a list of facts, keeping their order.
+        :return InternedFacts'''
+        props = tuple([self.proposition(prop) for prop in facts])
+        canonical = self.fact_tuples.get(props)
+        if canonical is None:
+            canonical = InternedFacts(props, self)
+            self.fact_tuples[props] = canonical
+        return canonical
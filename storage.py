@@ -0,0 +1,315 @@
+import mmap
+import struct
+
+from textworld.logic import Proposition, Variable
+
+import agent
+import hypotheses
+import interning
+
+MAGIC = b'EPLS'
+# version 1 stored no statistics, version 2 only the support of patterns; whatever a file doesn't store starts afresh
+VERSION = 3
+HEADER = struct.Struct('<4sBI')  # magic, version, number of schemas
+BUDGET = struct.Struct('<qq')  # max_patterns and max_bytes of the store, -1 if unlimited, following the header
+SCHEMA_ENTRY = struct.Struct('<QQQ')  # offset and length of a schema block and its evictions, preceded by its name
+SCHEMA_ENTRY_V2 = struct.Struct('<QQ')  # offset and length of a schema block, before version 3
+
+# tags for the kinds of terms occurring as arguments of Propositions and Actions
+NONE, VARIABLE, PLACEHOLDER, STRING = range(4)
+
+# Actions are stored by class name, so only these classes can be loaded
+action_classes = {cls.__name__: cls for cls in list(agent.name_to_action.values()) + [agent.Moves]}
+
+
+class Encoder:
+    '''Encodes the patterns of a single schema into a self-contained block of bytes. Strings are stored once in a table
+    at the start of the block and referred to by index; VariablePlaceholders are numbered across the whole file, so that
+    a placeholder shared between schemas is still shared after loading.'''
+
+    def __init__(self, placeholder_ids):
+        self.placeholder_ids = placeholder_ids  # VariablePlaceholder -> number, shared by all schemas of a file
+        self.strings = {}
+        self.body = bytearray()
+
+    def uint(self, value):
+        while value >= 0x80:  # LEB128
+            self.body.append((value & 0x7f) | 0x80)
+            value >>= 7
+        self.body.append(value)
+
+    def string(self, value):
+        self.uint(self.strings.setdefault(value, len(self.strings)))
+
+    def term(self, term):
+        if term is None:
+            self.uint(NONE)
+        elif type(term) == Variable:
+            self.uint(VARIABLE)
+            self.string(term.name)
+            self.string(term.type)
+        elif type(term) == hypotheses.VariablePlaceholder:
+            self.uint(PLACEHOLDER)
+            self.uint(self.placeholder_ids.setdefault(term, len(self.placeholder_ids)))
+            self.uint(0 if term.position is None else term.position + 1)
+            self.term(term.held_variable)
+        elif type(term) == str:
+            self.uint(STRING)
+            self.string(term)
+        else:
+            raise Exception('Cannot store terms of type %s' % type(term).__name__)
+
+    def proposition(self, prop):
+        self.string(prop.name)
+        self.uint(len(prop.arguments))
+        for arg in prop.arguments:
+            self.term(arg)
+
+    def action(self, act):
+        if act is None:
+            self.uint(0)
+            return
+        if action_classes.get(type(act).__name__) is not type(act):
+            raise Exception('Cannot store Actions of type %s' % type(act).__name__)
+        self.uint(1)
+        self.string(type(act).__name__)
+        self.uint(len(act.args))
+        for arg in act.args:
+            self.term(arg)
+        self.uint(len(act.vars))
+        for var in act.vars:
+            self.term(var)
+
+    def pattern(self, pattern):
+        pre, act, post = pattern
+        self.uint(len(pre))
+        for prop in pre:
+            self.proposition(prop)
+        self.action(act)
+        self.uint(len(post))
+        for prop in post:
+            self.proposition(prop)
+
+    def encode(self, patterns, statistics):
+        self.uint(len(patterns))
+        support, usage = statistics
+        for pattern, count, (hits, last_use) in zip(patterns, support, usage):
+            self.uint(count)
+            self.uint(hits)
+            self.uint(last_use)
+            self.pattern(pattern)
+        table = Encoder(self.placeholder_ids)
+        table.uint(len(self.strings))
+        for value in self.strings:  # in order of first use, which is the order of their indices
+            data = value.encode('utf-8')
+            table.uint(len(data))
+            table.body.extend(data)
+        return bytes(table.body + self.body)
+
+
+class Decoder:
+    '''Decodes a block of bytes written by Encoder back into a list of patterns.'''
+
+    def __init__(self, data, placeholders, interner, version=VERSION):
+        self.data = data
+        self.version = version
+        self.offset = 0
+        self.placeholders = placeholders  # number -> VariablePlaceholder, shared by all schemas of a file
+        self.interner = interner  # shares equal Variables and Propositions between all schemas of a file
+        self.strings = []
+
+    def uint(self):
+        value = shift = 0
+        while True:
+            byte = self.data[self.offset]
+            self.offset += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def string(self):
+        return self.strings[self.uint()]
+
+    def term(self):
+        tag = self.uint()
+        if tag == NONE:
+            return None
+        elif tag == VARIABLE:
+            name = self.string()
+            return self.interner.variable(Variable(name, self.string()))
+        elif tag == PLACEHOLDER:
+            number = self.uint()
+            position = self.uint()
+            held_variable = self.term()
+            if number not in self.placeholders:
+                self.placeholders[number] = hypotheses.VariablePlaceholder(held_variable,
+                                                                           None if position == 0 else position - 1)
+            return self.placeholders[number]
+        elif tag == STRING:
+            return self.string()
+        raise Exception('Corrupt pattern store, unknown term tag %d' % tag)
+
+    def proposition(self):
+        name = self.string()
+        return self.interner.proposition(Proposition(name, [self.term() for _ in range(self.uint())]))
+
+    def action(self):
+        if self.uint() == 0:
+            return None
+        cls = action_classes[self.string()]
+        args = [self.term() for _ in range(self.uint())]
+        vars = [self.term() for _ in range(self.uint())]
+        act = cls(*args)
+        act.vars = vars
+        return act
+
+    def pattern(self):
+        pre = [self.proposition() for _ in range(self.uint())]
+        act = self.action()
+        post = [self.proposition() for _ in range(self.uint())]
+        return hypotheses.freeze_pattern((pre, act, post))
+
+    def decode(self):
+        for _ in range(self.uint()):
+            length = self.uint()
+            self.strings.append(bytes(self.data[self.offset:self.offset + length]).decode('utf-8'))
+            self.offset += length
+        if self.version < 2:
+            return [self.pattern() for _ in range(self.uint())], None
+        patterns, support, usage = [], [], []
+        for _ in range(self.uint()):
+            support.append(self.uint())
+            if self.version >= 3:
+                usage.append((self.uint(), self.uint()))
+            patterns.append(self.pattern())
+        return patterns, (support, usage if self.version >= 3 else None)
+
+
+def save_store(pattern_store, path):
+    '''Saves a store of patterns to a file, which can be loaded with load_store. The budget of the store and the usage
+    statistics of the patterns are saved along with them.'''
+    store = hypotheses.as_pattern_store(pattern_store)
+    placeholder_ids = {}
+    blocks = [(name, Encoder(placeholder_ids).encode(store[name], store.index(name).statistics())) for name in store]
+    names = [name.encode('utf-8') for name, _ in blocks]
+    offset = HEADER.size + BUDGET.size + sum([2 + len(name) + SCHEMA_ENTRY.size for name in names])
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(blocks)))
+        f.write(BUDGET.pack(-1 if store.max_patterns is None else store.max_patterns,
+                            -1 if store.max_bytes is None else store.max_bytes))
+        for name, (schema_name, block) in zip(names, blocks):
+            f.write(struct.pack('<H', len(name)) + name +
+                    SCHEMA_ENTRY.pack(offset, len(block), store.evictions.get(schema_name, 0)))
+            offset += len(block)
+        for _, block in blocks:
+            f.write(block)
+
+
+class PendingSchema:
+    '''Stands in for the list of patterns of a schema in a MappedPatternStore until the schema is first used.'''
+
+    def __init__(self, mapping, offset, length, placeholders, interner, version):
+        self.mapping = mapping
+        self.offset = offset
+        self.length = length
+        self.placeholders = placeholders
+        self.interner = interner
+        self.version = version
+
+    def load(self):
+        '''
+        :return tuple (list of patterns, their statistics), see SchemaIndex.statistics, with None for the statistics if
+        the file doesn't store them'''
+        return Decoder(memoryview(self.mapping)[self.offset:self.offset + self.length], self.placeholders,
+                       self.interner, self.version).decode()
+
+
+class MappedPatternStore(hypotheses.PatternStore):
+    '''PatternStore backed by a memory-mapped file written by save_store. Only the list of schema names is read when the
+    store is opened; the patterns of a schema are decoded when they are first accessed.'''
+
+    def __getitem__(self, name):
+        patterns = super(MappedPatternStore, self).__getitem__(name)
+        if type(patterns) == PendingSchema:
+            patterns, statistics = patterns.load()
+            self[name] = patterns
+            self.owned.add(name)
+            if statistics is not None:
+                self.indices[name] = hypotheses.SchemaIndex(patterns, *statistics)
+        return patterns
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def index(self, name):
+        self[name]  # decodes the schema first, along with the index of its statistics
+        return super(MappedPatternStore, self).index(name)
+
+    def __iter__(self):  # makes dict() and ** go through __getitem__
+        return super(MappedPatternStore, self).__iter__()
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def pending(self):
+        '''Returns the names of the schemas which haven't been decoded yet.'''
+        return [name for name in self if type(super(MappedPatternStore, self).__getitem__(name)) == PendingSchema]
+
+    def copy(self):
+        store = MappedPatternStore(max_patterns=self.max_patterns, max_bytes=self.max_bytes)
+        for name in self:
+            dict.__setitem__(store, name, super(MappedPatternStore, self).__getitem__(name))
+        store.indices = dict(self.indices)
+        store.evictions = dict(self.evictions)
+        self.owned = set()
+        return store
+
+
+def load_store(path):
+    '''Opens a store of patterns saved with save_store. The file is memory-mapped and schemas are only decoded when they
+    are first used, so opening a store takes the same time regardless of its size.
+    :return MappedPatternStore'''
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, count = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC or not 1 <= version <= VERSION:
+        raise Exception('%s is not a pattern store of a supported version' % path)
+    offset = HEADER.size
+    placeholders = {}
+    interner = interning.Interner()
+    if version < 3:
+        store = MappedPatternStore()
+    else:
+        max_patterns, max_bytes = BUDGET.unpack_from(mapping, offset)
+        offset += BUDGET.size
+        store = MappedPatternStore(max_patterns=None if max_patterns < 0 else max_patterns,
+                                   max_bytes=None if max_bytes < 0 else max_bytes)
+    for _ in range(count):
+        (length,) = struct.unpack_from('<H', mapping, offset)
+        name = bytes(mapping[offset + 2:offset + 2 + length]).decode('utf-8')
+        offset += 2 + length
+        if version < 3:
+            block_offset, block_length = SCHEMA_ENTRY_V2.unpack_from(mapping, offset)
+            evictions = 0
+            offset += SCHEMA_ENTRY_V2.size
+        else:
+            block_offset, block_length, evictions = SCHEMA_ENTRY.unpack_from(mapping, offset)
+            offset += SCHEMA_ENTRY.size
+        if evictions:
+            store.evictions[name] = evictions
+        dict.__setitem__(store, name, PendingSchema(mapping, block_offset, block_length, placeholders,
+                                                            interner, version))
+    return store
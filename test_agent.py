@@ -1,4 +1,5 @@
-from unittest import TestCase
+import pickle
+from unittest import TestCase, mock
 
 import textworld
 from textworld.logic import Proposition, Variable
@@ -61,6 +62,18 @@ class Test_Agent(TestCase):
                                                                                                 'facts pertaining to '
                                                                                                 'object')
 
+    def test_fact_index(self):
+        facts = [Proposition('at', (Variable('foo', 'c'), Variable('kitchen', 'r'))),
+                 Proposition('in', (Variable('foo', 'c'), Variable('foo', 'c'))),
+                 Proposition('in', (Variable('bagel', 'f'), Variable('foo', 'c')))]
+        index = agent.FactIndex(facts)
+        self.assertEqual(facts, index.about(Variable('foo', 'c')), 'must list facts mentioning an object twice once')
+        self.assertEqual([Variable('foo', 'c'), Variable('bagel', 'f')], list(index.heads),
+                         'must keep the first arguments of facts in order')
+        self.assertEqual([facts[2]], agent.collect_facts_by_object(index, Variable('bagel', 'f')),
+                         'must collect facts from an index')
+        self.assertEqual([], index.about(Variable('bar', 'c')), 'must find no facts about unknown objects')
+
     def test_diff_facts(self):
         facts1 = [Proposition('at', (Variable('foo', 'c'), Variable('kitchen', 'r'))),
                   Proposition('in', (Variable('bagel', 'f'), Variable('foo', 'c'))),
@@ -143,6 +156,20 @@ class Test_Agent(TestCase):
         self.assertEqual(agent.command_to_action(insert_cmd), agent.Insert('chicken', 'zeppelin'))
         self.assertEqual(agent.command_to_action(put_cmd), agent.Put('bus', 'space shuttle'))
 
+    def test_action_hash(self):
+        facts = [Proposition('in', (Variable('key', 'k'), Variable('safe', 'c')))]
+        take = agent.command_to_action('take key from safe', facts)
+        self.assertEqual(hash(agent.Take('key', 'safe', facts=facts)), hash(take), 'equal actions must hash alike')
+        self.assertEqual(1, len({take, agent.command_to_action('take key from safe', facts)}),
+                         'must tell equal actions apart in sets')
+        self.assertEqual([None], agent.command_to_action('take key', []).vars,
+                         'must resolve variables against the given facts even for cached commands')
+        self.assertEqual((take, hash(take)), (lambda copy: (copy, hash(copy)))(pickle.loads(pickle.dumps(take))),
+                         'must pickle actions')
+        hashed = hash(take)
+        take.vars = [None, None]
+        self.assertNotEqual(hashed, hash(take), 'must hash again after the variables change')
+
     def test_fact_commonalities(self):
         fact1 = Proposition('at', (Variable('chair', 'o'), Variable('kitchen', 'r')))
         fact2 = Proposition('at', (Variable('table', 'o'), Variable('kitchen', 'r')))
@@ -260,6 +287,36 @@ class Test_Agent(TestCase):
                                                                                   'corresponding variable')
         self.assertEqual([], agent.Eat('waffle').vars, 'must not fill the vars list unless asked to')
 
+    def test_symbol_table(self):
+        facts = [Proposition('at', (Variable('sink', 'c'), Variable('kitchen', 'r'))),
+                 Proposition('at', (Variable('sink', 'o'), Variable('kitchen', 'r')))]
+        table = agent.symbol_table(facts)
+        self.assertEqual({'sink': Variable('sink', 'c'), 'kitchen': Variable('kitchen', 'r')}, table,
+                         'must map names to the first Variable with that name')
+        frozen = tuple(facts)
+        self.assertIs(agent.symbol_table(frozen), agent.symbol_table(frozen), 'must reuse the table for the same facts')
+        facts[0] = Proposition('in', (Variable('cup', 'c'), Variable('sink', 'o')))
+        self.assertEqual(Variable('sink', 'o'), agent.symbol_table(facts).get('sink'),
+                         'must not reuse the table of facts which changed in place')
+
+    def test_symbol_table_reuse(self):
+        lookups = []
+        build = agent.symbol_table
+
+        def recording(facts):
+            cached = agent.symbol_tables.get(id(facts))
+            lookups.append(cached is not None and cached[0] is facts)
+            return build(facts)
+
+        with mock.patch.object(agent, 'symbol_table', recording):
+            exp_gatherer = agent.ExperienceGatherer(agent.ExperienceGatheringAgent(2235101))
+            exp_gatherer.gather_experience(textworld.start('games/1ob_1room.z8', agent.infos), 200)
+            self.assertGreater(sum(lookups), len(lookups) / 2,
+                               'must reuse the tables of states the gatherer has already acted in')
+            del lookups[:]
+            agent.get_experience_from_walkthrough(textworld.start('test_games/simplest_1o_1r.z8', agent.infos), True)
+            self.assertNotEqual([], lookups, 'must resolve the walkthrough actions against interned facts')
+
     def test_experience_gatherer(self):
         facts = [Proposition('at', (Variable('P', 'P'), Variable('pantry', 'r'))),
                  Proposition('at', (Variable('crate', 'c'), Variable('pantry', 'r'))),
@@ -295,6 +352,8 @@ class Test_Agent(TestCase):
         exp2_is_in = experience_is_in(walkthrough_exp[1], experiences)
         self.assertEqual(exp2_is_in, True, 'second part of walkthrough experience should show up in random choice '
                                            'experience')
+        self.assertEqual(set(experiences), exp_gatherer.transitions, 'must remember every experience gathered')
+        self.assertEqual(len(experiences), len(exp_gatherer.transitions), 'must not gather an experience twice')
 
     def test_gather_multiple(self):
         facts1 = [Proposition('at', (Variable('P', 'P'), Variable('pantry', 'r'))),
@@ -374,3 +433,29 @@ class Test_Agent(TestCase):
                          'should gather parts of actual walkthrough in the random play on multiple games')
         self.assertEqual(exp2_is_present, True, 'should gather parts of actual walkthrough in the random play on '
                                                 'multiple games')
+
+    def test_gather_multiple_parallel(self):
+        games = ['games/simplest_1o_1r.z8', 'games/1ob_1room.z8']
+        exp_gatherer = agent.ExperienceGatherer(agent.ExperienceGatheringAgent(2567121))
+        experiences = exp_gatherer.gather_experience_multiple(games, 200, processes=2)
+        expected = []
+        for ix, game in enumerate(games):
+            single_gatherer = agent.ExperienceGatherer(agent.ExperienceGatheringAgent(2567121 + ix))
+            expected.extend([exp for exp in single_gatherer.gather_experience_multiple([game], 200)
+                             if exp not in expected])
+        self.assertEqual([(list(facts), action, list(new_facts)) for facts, action, new_facts in expected],
+                         [(list(facts), action, list(new_facts)) for facts, action, new_facts in experiences],
+                         'must gather every game with its own seeded agent and merge the games in order')
+
+    def test_rebuild_experience(self):
+        key, safe = Variable('key', 'k'), Variable('safe', 'c')
+        experience = pickle.loads(pickle.dumps(([Proposition('in', (key, safe))], agent.Take('key', facts=[
+            Proposition('in', (key, safe))]), [Proposition('in', (key, Variable('I', 'I')))])))
+        experience[0][0]._hash += 1  # as if it had been hashed in another process
+        experience[1].vars[0]._hash += 1
+        facts, action, new_facts = agent.rebuild_experience(experience, {})
+        self.assertEqual({Proposition('in', (key, safe))}, set(facts) & {Proposition('in', (key, safe))},
+                         'must hash rebuilt facts as in this process')
+        self.assertEqual(hash(agent.Take('key', facts=[Proposition('in', (key, safe))])), hash(action),
+                         'must hash rebuilt actions as in this process')
+        self.assertEqual([Proposition('in', (key, Variable('I', 'I')))], new_facts, 'must rebuild all facts')
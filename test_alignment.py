@@ -0,0 +1,35 @@
+from unittest import TestCase
+import numpy as np
+from textworld.logic import Proposition, Variable
+import alignment
+import hypotheses
+
+
+class TestAlignment(TestCase):
+    def test_assign(self):
+        self.assertEqual([1, 0], alignment.assign(np.array([[3, 2], [3, 0]])),
+                         'must maximise the sum of the ratings rather than take the best rating first')
+        self.assertEqual([2, 0], alignment.assign(np.array([[0, 1, 5], [4, 0, 5]])),
+                         'must leave columns unassigned when there are more columns than rows')
+        self.assertEqual([], alignment.assign(np.zeros((0, 3))), 'must handle empty matrices')
+        with self.assertRaises(ValueError, msg='must reject matrices with more rows than columns'):
+            alignment.assign(np.zeros((3, 2)))
+
+    def test_align_prop_lists(self):
+        vp = hypotheses.VariablePlaceholder()
+        key, box = Variable('key', 'o'), Variable('box', 'c')
+        props1 = [Proposition('in', (vp, box)), Proposition('in', (key, box)), Proposition('at', (key, box))]
+        props2 = [Proposition('at', (key, box)), Proposition('in', (key, box)),
+                  Proposition('in', (Variable('pen', 'o'), Variable('jar', 'c')))]
+        self.assertEqual([(props1[0], props2[2]), (props1[1], props2[1]), (props1[2], props2[0])],
+                         alignment.align_prop_lists(props1, props2),
+                         'must find the best alignment within every name')
+        self.assertEqual([(props1[0], props2[1]), (props1[1], props2[2]), (props1[2], props2[0])],
+                         hypotheses.align_prop_lists(props1, props2, method='greedy'),
+                         'must keep pairing Propositions in turn when aligning greedily')
+        self.assertEqual(alignment.align_prop_lists(props1, props2),
+                         hypotheses.align_prop_lists(props1, props2, method='optimal'),
+                         'must align optimally on request')
+        self.assertEqual((None, None), alignment.align_prop_lists(props1, props2[1:]),
+                         'must fail when a Proposition has no counterpart')
+        self.assertEqual([], alignment.align_prop_lists([], props2), 'must align empty lists')
@@ -1,10 +1,32 @@
+import pickle
+from copy import deepcopy
 from unittest import TestCase
 from textworld.logic import Proposition, Variable
-from train_test_epl import train
+from train_test_epl import train, train_parallel, CONTAINMENT_TRAINING, SOURCE_PATH_GOAL_TRAINING
 import agent
 import hypotheses
 
 
+def rename_placeholders(obj, names=None):
+    '''Replaces every VariablePlaceholder in a store, pattern or Proposition with a name given by the order of its
+    first appearance, so that the results of separate learning runs can be compared.'''
+    names = {} if names is None else names
+    if isinstance(obj, hypotheses.VariablePlaceholder):
+        return names.setdefault(obj, 'VAR-%d' % len(names))
+    elif isinstance(obj, dict):
+        return {name: rename_placeholders(patterns, names) for name, patterns in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)([rename_placeholders(o, names) for o in obj])
+    elif isinstance(obj, Proposition):
+        return (obj.name, tuple([rename_placeholders(arg, names) for arg in obj.arguments]))
+    elif isinstance(obj, hypotheses.BoundPattern):
+        return rename_placeholders(obj.materialize(), names)
+    elif isinstance(obj, agent.Action):
+        return type(obj), obj.command_template, rename_placeholders(list(obj.args), names), \
+               rename_placeholders(list(obj.vars), names)
+    return obj
+
+
 class TestHypotheses(TestCase):
     bread_in_fridge = Proposition('in', (Variable('bread', 'f'), Variable('fridge', 'c')))
     chair_at_kitchen = Proposition('at', (Variable('chair', 'o'), Variable('kitchen', 'r')))
@@ -35,6 +57,35 @@ class TestHypotheses(TestCase):
         self.assertEqual(False, vp.holds_same_as(hypotheses.VariablePlaceholder(Variable('pickle', 'f'))),
                          'must recognize when another placeholder holds a different variable')
 
+    def test_placeholder_ids(self):
+        vp1, vp2 = hypotheses.VariablePlaceholder(), hypotheses.VariablePlaceholder()
+        self.assertEqual(type(vp1.id), int, 'must identify placeholders by integers')
+        self.assertLess(vp1.id, vp2.id, 'must number placeholders in the order they are made')
+        self.assertEqual('VAR-%d' % vp1.id, vp1.name, 'must name placeholders after their id')
+        self.assertRaises(AttributeError, setattr, vp1, 'label', 'x')
+        copy = deepcopy([vp1, vp1])
+        self.assertIs(copy[0], copy[1], 'must keep placeholders shared in deep copies')
+        self.assertEqual(vp1, copy[0], 'must keep the id in copies')
+        received = pickle.loads(pickle.dumps(hypotheses.VariablePlaceholder(placeholder_id=vp2.id + 1000)))
+        self.assertLess(received.id, hypotheses.VariablePlaceholder().id,
+                        'must not hand out ids of placeholders received from elsewhere')
+
+    def test_renumber_placeholders(self):
+        vp = hypotheses.VariablePlaceholder(position=0)
+        facts = [Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))]
+        act = hypotheses.substitute_action_arguments(agent.Put('key', 'box', facts), {Variable('key', 'o'): vp})
+        pattern = ([Proposition('in', (vp, Variable('I', 'I')))], act, [Proposition('in', (vp, Variable('box', 'c')))])
+        renumbered = hypotheses.renumber_placeholders([pattern, deepcopy(pattern)])
+        pre, act, post = renumbered[0]
+        self.assertNotEqual(vp.id, pre[0].arguments[0].id, 'must give placeholders new ids')
+        self.assertIs(pre[0].arguments[0], post[0].arguments[0], 'must keep placeholders shared')
+        self.assertIs(pre[0].arguments[0], act.vars[0], 'must keep placeholders shared with actions')
+        self.assertEqual(pre[0].arguments[0].name, act.args[0], 'must rename action arguments')
+        self.assertEqual(0, pre[0].arguments[0].position, 'must keep positions')
+        self.assertEqual(renumbered[0], renumbered[1], 'must keep equal placeholders equal')
+        self.assertEqual(rename_placeholders((pattern[0], pattern[2])), rename_placeholders((pre, post)),
+                         'must not change anything but the placeholders')
+
     def test_reconcile_patterns(self):
         first_vp = hypotheses.VariablePlaceholder()
         first_var_placeholder_pattern = ([Proposition('in', (first_vp, Variable('fridge', 'c')))], None,
@@ -69,6 +120,36 @@ class TestHypotheses(TestCase):
                          'must not reconcile irreconcilable patterns where post-conditions differ too much')
         return
 
+    def test_reconcile_patterns_failing_preconditions(self):
+        vp1, vp2 = hypotheses.VariablePlaceholder(position=0), hypotheses.VariablePlaceholder(position=1)
+        self.assertEqual((None, None),
+                         hypotheses.reconcile_patterns(([Proposition('in', (vp1, Variable('box', 'c')))],
+                                                        agent.Take(vp1, 'box'), []),
+                                                       ([Proposition('in', (vp2, Variable('box', 'c')))],
+                                                        agent.Take(vp2, 'box'), [])),
+                         'must not reconcile patterns whose pre-conditions can\'t be reconciled')
+
+    def test_substitution(self):
+        substitution = hypotheses.Substitution()
+        box, jar = Variable('box', 'c'), Variable('jar', 'c')
+        vp1, vp2, vp3 = hypotheses.VariablePlaceholder(), hypotheses.VariablePlaceholder(), \
+            hypotheses.VariablePlaceholder()
+        substitution.union(0, box, vp1)
+        self.assertEqual(vp1, substitution.find(0, box), 'must substitute placeholders for terms')
+        self.assertEqual(box, substitution.find(1, box), 'must keep the substitutions of both patterns apart')
+        mark = substitution.mark()
+        substitution.union(0, vp1, vp2)
+        substitution.union(0, jar, vp3)
+        self.assertEqual(vp1, substitution.find(0, box),
+                         'must keep the first placeholder substituted for a term as its substitute')
+        self.assertEqual((True, True), (substitution.is_substitute(0, vp2), substitution.is_substitute(0, vp3)),
+                         'must recognise substituted placeholders')
+        self.assertEqual(({box: vp1, jar: vp3}, {}), substitution.as_dicts(), 'must list the substituted terms')
+        substitution.undo(mark)
+        self.assertEqual(({box: vp1}, {}), substitution.as_dicts(), 'must undo the substitutions made since the mark')
+        self.assertEqual((False, 1), (substitution.is_substitute(0, vp2), len(substitution)),
+                         'must undo the substitutions made since the mark')
+
     def test_match_props(self):
         self.assertEqual((None, None),
                          hypotheses.match_propositions(Proposition('closed', (Variable('door', 'd'),)), []),
@@ -219,6 +300,226 @@ class TestHypotheses(TestCase):
         self.assertEqual(True, hypotheses.propositions_actions_names_match(([], None, []), ([], None, [])),
                          'must return True when comparing element names of two empty patterns')
 
+    def test_pattern_signature(self):
+        self.assertEqual(((), type(None), ()), hypotheses.pattern_signature(([], None, [])),
+                         'must compute the signature of an empty pattern')
+        self.assertEqual((('at', 'in', 'in'), agent.Take, ('in',)),
+                         hypotheses.pattern_signature(([self.bread_in_fridge, self.chair_at_kitchen,
+                                                        self.orange_in_fridge],
+                                                       agent.Take('bread', 'fridge'),
+                                                       [self.bread_in_box])),
+                         'must count every proposition name in the signature')
+        self.assertNotEqual(hypotheses.pattern_signature(([self.bread_in_fridge], None, [self.bread_in_fridge])),
+                            hypotheses.pattern_signature(([self.bread_in_fridge], None, [self.chair_at_kitchen])),
+                            'must distinguish patterns by their post-conditions')
+
+    def test_pattern_store(self):
+        store = hypotheses.PatternStore({'CONTAINMENT': [([self.bread_in_fridge], None, [self.bread_in_fridge])]})
+        self.assertEqual({'CONTAINMENT': [([self.bread_in_fridge], None, [self.bread_in_fridge])]}, store,
+                         'must compare equal to a plain dictionary of patterns')
+        store.add('CONTAINMENT', ([self.chair_at_kitchen], None, [self.chair_at_kitchen]))
+        store.add('CONTAINMENT', ([self.orange_in_fridge], None, [self.orange_in_fridge]))
+        store.add('SUPPORT', ([self.chair_at_kitchen], None, [self.chair_at_kitchen]))
+        self.assertEqual([0, 2], store.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.bread_in_box], None, [self.bread_in_box]))), 'must find all patterns with a signature in order')
+        self.assertEqual([1], store.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.chair_at_kitchen], None, [self.chair_at_kitchen]))), 'must index appended patterns')
+        self.assertEqual([], store.lookup('BLOCKAGE', hypotheses.pattern_signature(([], None, []))),
+                         'must not find patterns in nonexistent schemas')
+        store.replace('CONTAINMENT', 0, ([self.chair_at_kitchen], None, [self.bread_in_box]))
+        self.assertEqual([2], store.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.bread_in_box], None, [self.bread_in_box]))), 'must keep the index up to date on replacement')
+        self.assertEqual([0], store.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.chair_at_kitchen], None, [self.bread_in_box]))), 'must keep the index up to date on replacement')
+        self.assertEqual(2, len(store), 'must create new schemas when adding to them')
+        self.assertEqual([0, 1], store.index('CONTAINMENT').candidates({('proposition', 'at')}),
+                         'must find patterns by proposition name')
+        self.assertEqual([0, 2], store.index('CONTAINMENT').candidates({('variable', 'fridge'),
+                                                                         ('variable', 'box')}),
+                         'must find patterns by the union of their features')
+        self.assertEqual([], store.index('CONTAINMENT').candidates({('action', agent.Take)}),
+                         'must not find patterns without any of the features')
+
+    def test_pattern_features(self):
+        vp = hypotheses.VariablePlaceholder()
+        self.assertEqual(set(), hypotheses.pattern_features(([], None, [])), 'empty patterns have no features')
+        self.assertEqual({('proposition', 'in'), ('proposition', 'at'), ('action', agent.Take),
+                          ('variable', 'fridge'), ('variable', 'chair'), ('variable', 'kitchen'),
+                          ('variable', 'bread')},
+                         hypotheses.pattern_features(([Proposition('in', (vp, Variable('fridge', 'c')))],
+                                                      agent.Take(vp, Variable('bread', 'f')),
+                                                      [self.chair_at_kitchen])),
+                         'must collect proposition names, action types and concrete variable names')
+
+    def test_pattern_store_copy_and_rollback(self):
+        store = hypotheses.PatternStore()
+        store.add('CONTAINMENT', ([self.bread_in_fridge], None, [self.bread_in_fridge]))
+        store.add('SUPPORT', ([self.chair_at_kitchen], None, [self.chair_at_kitchen]))
+        copied = store.copy()
+        copied.add('CONTAINMENT', ([self.bread_in_box], None, [self.bread_in_box]))
+        self.assertEqual(1, len(store['CONTAINMENT']), 'changes to a copy must not affect the original')
+        self.assertEqual(2, len(copied['CONTAINMENT']), 'changes to a copy must be visible in the copy')
+        self.assertIs(store['SUPPORT'], copied['SUPPORT'], 'unchanged schemas must be shared between copies')
+        store.replace('SUPPORT', 0, ([self.orange_in_fridge], None, [self.orange_in_fridge]))
+        self.assertEqual([([self.chair_at_kitchen], None, [self.chair_at_kitchen])], copied['SUPPORT'],
+                         'changes to the original must not affect a copy')
+
+        before = {'CONTAINMENT': list(copied['CONTAINMENT']), 'SUPPORT': list(copied['SUPPORT'])}
+        token = copied.snapshot()
+        copied.add('CONTAINMENT', ([self.orange_in_fridge], None, [self.orange_in_fridge]))
+        copied.replace('CONTAINMENT', 0, ([self.bread_in_box], None, [self.bread_in_box]))
+        copied.add('BLOCKAGE', ([self.chair_at_kitchen], None, []))
+        copied.add_support('CONTAINMENT', 1, 3)
+        copied.assign('SUPPORT', [])
+        copied.assign('SOURCE-PATH-GOAL', [([self.chair_at_kitchen], None, [])])
+        copied.rollback(token)
+        self.assertEqual(before, copied, 'must undo all changes made since the snapshot')
+        self.assertEqual(1, copied.support('CONTAINMENT', 1), 'must undo added support')
+        self.assertEqual([0, 1], copied.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.orange_in_fridge], None, [self.orange_in_fridge]))), 'must restore the index on rollback')
+        self.assertEqual(None, copied.journal, 'must stop recording changes once all snapshots are closed')
+        try:
+            with copied.transaction():
+                copied.add('CONTAINMENT', ([self.orange_in_fridge], None, [self.orange_in_fridge]))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(before, copied, 'must roll back failed transactions')
+
+    def test_schema_index_copy(self):
+        bread, orange = ([self.bread_in_fridge], None, [self.bread_in_box]), ([self.orange_in_fridge], None, [])
+        signature = hypotheses.pattern_signature(bread)
+        index = hypotheses.SchemaIndex([bread, orange])
+        copied = index.copy()
+        self.assertIs(index.positions[signature], copied.positions[signature], 'must share the slots of copies')
+        index.append(([self.bread_in_box], None, [self.bread_in_fridge]))
+        self.assertEqual([0], copied.lookup(signature), 'changes to the original must not affect a copy')
+        self.assertEqual([0, 2], index.lookup(signature), 'changes to the original must be visible in the original')
+        copied.remove(0)
+        self.assertEqual([], copied.lookup(signature), 'changes to a copy must be visible in the copy')
+        self.assertEqual([0, 2], index.lookup(signature), 'changes to a copy must not affect the original')
+        self.assertEqual([0], copied.candidates({('variable', 'orange')}), 'must keep the postings of a copy')
+        self.assertEqual([1], index.candidates({('variable', 'orange')}), 'must keep the postings of the original')
+        store = hypotheses.PatternStore({'CONTAINMENT': [bread, orange]})
+        learned = hypotheses.learn(([self.chair_at_kitchen], None, [self.bread_in_box]), 'CONTAINMENT', store)
+        self.assertIndexed(store, 'CONTAINMENT', 'learning into a copy must keep the index of the original')
+        self.assertIndexed(learned, 'CONTAINMENT', 'learning into a copy must keep its index up to date')
+
+    def test_pattern_store_budget(self):
+        store = hypotheses.PatternStore(max_patterns=4)
+        for pattern in [([self.bread_in_fridge], None, [self.bread_in_fridge]),
+                        ([self.bread_in_box], None, [self.bread_in_box]),
+                        ([self.orange_in_fridge], None, [self.orange_in_fridge]),
+                        ([self.chair_at_kitchen], None, [self.chair_at_kitchen])]:
+            store.add('CONTAINMENT', pattern)
+        store.record_use('CONTAINMENT', store['CONTAINMENT'][1])
+        token = store.snapshot()
+        store.add('CONTAINMENT', ([self.orange_in_fridge], None, [self.bread_in_fridge]))
+        self.assertEqual([([self.bread_in_fridge], None, [self.bread_in_fridge]),
+                          ([self.bread_in_box], None, [self.bread_in_box]),
+                          ([self.chair_at_kitchen], None, [self.chair_at_kitchen]),
+                          ([self.orange_in_fridge], None, [self.bread_in_fridge])], store['CONTAINMENT'],
+                         'must evict the least used exception when the schema grows past the budget')
+        self.assertEqual({'CONTAINMENT': 1}, store.evictions, 'must count evictions')
+        self.assertEqual([0, 1, 3], store.lookup('CONTAINMENT', hypotheses.pattern_signature(
+            ([self.bread_in_fridge], None, [self.bread_in_fridge]))), 'must update the index on eviction')
+        store.rollback(token)
+        self.assertEqual(([self.orange_in_fridge], None, [self.orange_in_fridge]), store['CONTAINMENT'][2],
+                         'must put evicted patterns back on rollback')
+        self.assertEqual(([0, 1, 0, 0], 0), (store.index('CONTAINMENT').hits, store.evictions['CONTAINMENT']),
+                         'must put back the statistics of evicted patterns on rollback')
+
+        small = hypotheses.PatternStore(max_bytes=1)
+        for pattern in store['CONTAINMENT']:
+            small.add('CONTAINMENT', pattern)
+        self.assertEqual(2, len(small['CONTAINMENT']), 'must keep the last added pattern and those with no exceptions')
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        _, matched, _, _ = hypotheses.make_inference(([self.bread_in_fridge], None, []), kb)
+        self.assertEqual(1, sum(kb.index('CONTAINMENT').hits), 'must count patterns retrieved for inferences')
+        copied = kb.copy()
+        hypotheses.make_inference(([self.bread_in_fridge], None, []), copied)
+        self.assertIs(kb['CONTAINMENT'], copied['CONTAINMENT'], 'must not copy a schema to count a retrieval')
+        self.assertEqual(2, sum(kb.index('CONTAINMENT').hits), 'must count retrievals in stores sharing the pattern')
+        matched_ix = kb.index('CONTAINMENT').position(matched)
+        copied.add_support('CONTAINMENT', matched_ix)
+        self.assertNotEqual(kb.index('CONTAINMENT').last_use[matched_ix],
+                            copied.index('CONTAINMENT').last_use[matched_ix],
+                            'must stop sharing the usage of a pattern once one of the stores changes it')
+
+    def test_pattern_store_deduplication(self):
+        vp1, vp2, vp3 = [hypotheses.VariablePlaceholder(position=0) for _ in range(3)]
+        store = hypotheses.PatternStore()
+        store.add('CONTAINMENT', ([self.bread_in_fridge], None, [self.bread_in_fridge]))
+        store.add('CONTAINMENT', ([Proposition('in', (vp1, Variable('box', 'c')))], None,
+                                  [Proposition('in', (vp1, Variable('box', 'c')))]))
+        token = store.snapshot()
+        store.add('CONTAINMENT', ([Proposition('in', (vp2, Variable('box', 'c')))], None,
+                                  [Proposition('in', (vp2, Variable('box', 'c')))]), support=2)
+        self.assertEqual((2, [1, 3]), (len(store['CONTAINMENT']), store.index('CONTAINMENT').support),
+                         'must count alpha-equivalent patterns as support instead of storing them twice')
+        store.rollback(token)
+        self.assertEqual([1, 1], store.index('CONTAINMENT').support, 'must undo the support on rollback')
+        self.assertEqual(1, store.find('CONTAINMENT', ([Proposition('in', (vp3, Variable('box', 'c')))], None,
+                                                       [Proposition('in', (vp3, Variable('box', 'c')))])),
+                         'must find alpha-equivalent patterns')
+        self.assertIsNone(store.find('CONTAINMENT', ([Proposition('in', (vp3, Variable('box', 'c')))], None,
+                                                     [Proposition('in', (vp2, Variable('box', 'c')))])),
+                          'must not find patterns sharing placeholders differently')
+        store.evict('CONTAINMENT', 0)
+        self.assertEqual(0, store.find('CONTAINMENT', store['CONTAINMENT'][0]), 'must update the index on eviction')
+
+    def assertIndexed(self, store, name, msg):
+        index, fresh = store.index(name), hypotheses.SchemaIndex(store[name])
+        for signature in set(fresh.signatures):
+            self.assertEqual(fresh.lookup(signature), index.lookup(signature), msg)
+        for form in fresh.forms:
+            self.assertEqual(fresh.find(form), index.find(form), msg)
+        for features in fresh.features:
+            self.assertEqual(fresh.candidates(features), index.candidates(features), msg)
+        self.assertEqual(fresh.total_size(store[name]), store.schema_size(name), msg)
+
+    def test_pattern_store_repeated_eviction(self):
+        objects = [Variable(name, 'o') for name in ['bread', 'orange', 'chair', 'box', 'key']]
+        store = hypotheses.PatternStore(max_patterns=4)
+        store.add('CONTAINMENT', ([self.bread_in_fridge], None, [self.bread_in_fridge]))
+        token = store.snapshot()
+        for obj in objects:
+            for container in objects:
+                store.add('CONTAINMENT', ([Proposition('in', (obj, container))], None,
+                                          [Proposition('on', (obj, container))]))
+                store.add('CONTAINMENT', ([Proposition('at', (obj, container))], None, []))
+        self.assertEqual(4, len(store['CONTAINMENT']), 'must stay within the budget')
+        self.assertEqual(47, store.evictions['CONTAINMENT'], 'must evict once per pattern added past the budget')
+        self.assertIndexed(store, 'CONTAINMENT', 'must keep the index up to date on eviction')
+        store.rollback(token)
+        self.assertEqual(0, store.evictions['CONTAINMENT'], 'must put evicted patterns back on rollback')
+        self.assertIndexed(store, 'CONTAINMENT', 'must keep the index up to date on rollback')
+
+    def test_pattern_store_statistics(self):
+        store = hypotheses.PatternStore(max_patterns=3)
+        store.assign('CONTAINMENT', [([self.bread_in_fridge], None, [self.bread_in_fridge]),
+                                     ([self.bread_in_box], None, [self.bread_in_box]),
+                                     ([self.orange_in_fridge], None, [self.orange_in_fridge])],
+                     [4, 2, 1], [(0, 900), (5, 700), (1, 800)])
+        index = store.index('CONTAINMENT')
+        self.assertEqual(([4, 2, 1], [0, 5, 1]), (index.support, index.hits), 'must keep the assigned statistics')
+        self.assertTrue(index.last_use[1] < index.last_use[2] < index.last_use[0],
+                        'must keep the order in which the assigned patterns were last used')
+        token = store.snapshot()
+        store.assign('CONTAINMENT', [([self.chair_at_kitchen], None, [])])
+        store.rollback(token)
+        self.assertIs(index, store.index('CONTAINMENT'), 'must restore the statistics on rollback')
+        store.evict('CONTAINMENT', 2)
+        for label, copied in [('pickled', pickle.loads(pickle.dumps(store))), ('copied', deepcopy(store))]:
+            self.assertEqual(store, copied, 'must keep the patterns when %s' % label)
+            copied_index = copied.index('CONTAINMENT')
+            self.assertEqual(([4, 2], [0, 5]), (copied_index.support, copied_index.hits),
+                             'must keep the statistics when %s' % label)
+            self.assertTrue(copied_index.last_use[1] < copied_index.last_use[0],
+                            'must keep the order in which patterns were last used when %s' % label)
+            self.assertEqual((3, {'CONTAINMENT': 1}), (copied.max_patterns, copied.evictions),
+                             'must keep the budget and evictions when %s' % label)
+
     def test_align_prop_lists(self):
         self.assertEqual([], hypotheses.align_prop_lists([], []))
 
@@ -348,6 +649,183 @@ class TestHypotheses(TestCase):
                          'must properly abstract variables in post-conditions in proper patterns')
         self.assertEqual(hypotheses.VariablePlaceholder, type(result_seventh['CONTAINMENT'][1][2][0].arguments[1]),
                          'must properly abstract variables in post-conditions in proper patterns')
+        self.assertEqual(2, len(result_sixth_source_goal_2['CONTAINMENT']),
+                         'must not change the given knowledge base unless asked to')
+        self.assertRaises(Exception, hypotheses.learn, ([self.bread_in_box], None, [self.bread_in_box]),
+                          'CONTAINMENT', {}, inplace=True)
+        store = hypotheses.PatternStore()
+        self.assertIs(store, hypotheses.learn(([self.bread_in_box], None, [self.bread_in_box]), 'CONTAINMENT', store,
+                                              inplace=True), 'must return the same store when learning in place')
+        hypotheses.learn(([self.bread_in_fridge], None, [self.bread_in_fridge]), 'CONTAINMENT', store, inplace=True)
+        self.assertEqual(1, len(store['CONTAINMENT']), 'must reconcile patterns when learning in place')
+        self.assertEqual(hypotheses.VariablePlaceholder, type(store['CONTAINMENT'][0][0][0].arguments[1]),
+                         'must reconcile patterns when learning in place')
+
+    def test_subsumes(self):
+        kb = hypotheses.learn(([self.bread_in_fridge], None, [self.bread_in_fridge]), 'CONTAINMENT', {})
+        kb = hypotheses.learn(([self.orange_in_fridge], None, [self.orange_in_fridge]), 'CONTAINMENT', kb)
+        general = kb['CONTAINMENT'][0]
+        apple_in_fridge = Proposition('in', (Variable('apple', 'f'), Variable('fridge', 'c')))
+        self.assertEqual(True, hypotheses.subsumes(general, ([apple_in_fridge], None, [apple_in_fridge])),
+                         'must recognise instances of a general pattern')
+        self.assertEqual(False, hypotheses.subsumes(general, ([apple_in_fridge], None, [self.bread_in_fridge])),
+                         'must bind every placeholder to a single Variable')
+        self.assertEqual(False, hypotheses.subsumes(general, ([self.bread_in_box], None, [self.bread_in_box])),
+                         'must not bind concrete Variables')
+        self.assertEqual(False, hypotheses.subsumes(kb['CONTAINMENT'][0], kb['CONTAINMENT'][0]),
+                         'must only bind placeholders to Variables')
+
+        learned = hypotheses.learn(([apple_in_fridge], None, [apple_in_fridge]), 'CONTAINMENT', kb)
+        self.assertIs(general, learned['CONTAINMENT'][0], 'must keep patterns which already cover an experience')
+        self.assertEqual((2, 3), (kb.support('CONTAINMENT', 0), learned.support('CONTAINMENT', 0)),
+                         'must count covered experiences as support')
+        self.assertEqual(kb.index('CONTAINMENT').version, learned.index('CONTAINMENT').version,
+                         'must not invalidate inferences from covering patterns')
+
+    def test_generalize(self):
+        experiences = [([Proposition('in', (Variable(name, 'f'), Variable('fridge', 'c')))],
+                        agent.Take(Variable(name, 'f'), Variable('fridge', 'c')),
+                        [Proposition('in', (Variable(name, 'f'), Variable('I', 'I')))])
+                       for name in ['bread', 'orange', 'apple']]
+        pre, act, post = hypotheses.generalize(experiences)
+        self.assertEqual((hypotheses.VariablePlaceholder, Variable('fridge', 'c')),
+                         (type(pre[0].arguments[0]), pre[0].arguments[1]),
+                         'must replace only the arguments that vary between experiences')
+        self.assertEqual(0, pre[0].arguments[0].position, 'must give placeholders the position they first occur at')
+        self.assertIs(pre[0].arguments[0], act.vars[0], 'must share placeholders between a column\'s occurrences')
+        self.assertIs(pre[0].arguments[0], post[0].arguments[0], 'must share placeholders with post-conditions')
+        learned = {}
+        for experience in experiences:
+            learned = hypotheses.learn(experience, 'CONTAINMENT', learned)
+        self.assertEqual(rename_placeholders(learned['CONTAINMENT']), rename_placeholders([(pre, act, post)]),
+                         'must generalize like reconciling the experiences one at a time')
+        self.assertEqual(None, hypotheses.generalize([([self.bread_in_fridge], None, [self.bread_in_fridge]),
+                                                      ([self.bread_in_fridge], None, [self.orange_in_fridge])]),
+                         'must not generalize post-conditions which the pre-conditions don\'t account for')
+        self.assertEqual(None, hypotheses.generalize([([self.bread_in_fridge], None, []),
+                                                      ([self.chair_at_kitchen], None, [])]),
+                         'must only generalize experiences with the same signature')
+
+    def test_learn_many(self):
+        facts = [Proposition('in', (Variable('key', 'o'), Variable('I', 'I'))),
+                 Proposition('in', (Variable('map', 'o'), Variable('I', 'I'))),
+                 Proposition('at', (Variable('box', 'c'), Variable('room', 'r')))]
+        experiences = [
+            ([self.orange_in_fridge], None, [self.orange_in_fridge]),
+            ([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))], agent.Put('key', 'box', facts),
+             [Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))]),
+            ([self.bread_in_fridge], None, [self.bread_in_fridge]),
+            ([], None, []),
+            ([self.bread_in_fridge], None, [self.chair_at_kitchen]),
+            ([self.orange_in_fridge], None, [self.orange_in_fridge]),
+            ([Proposition('in', (Variable('map', 'o'), Variable('I', 'I')))], agent.Put('map', 'box', facts),
+             [Proposition('in', (Variable('map', 'o'), Variable('box', 'c')))]),
+            ([self.bread_in_box], None, [self.chair_at_kitchen]),
+            ([self.bread_in_box], None, [self.chair_at_kitchen]),
+        ]
+        sequential = {'SUPPORT': []}
+        for experience in experiences:
+            sequential = hypotheses.learn(experience, 'CONTAINMENT', sequential)
+        batched = hypotheses.learn_many(experiences, 'CONTAINMENT', {'SUPPORT': []})
+        self.assertEqual(rename_placeholders(sequential), rename_placeholders(batched),
+                         'must learn the same patterns as learning one experience at a time')
+        self.assertEqual([sequential.support('CONTAINMENT', ix) for ix in range(len(sequential['CONTAINMENT']))],
+                         [batched.support('CONTAINMENT', ix) for ix in range(len(batched['CONTAINMENT']))],
+                         'must count the same support as learning one experience at a time')
+        self.assertEqual(['SUPPORT', 'CONTAINMENT'], list(batched), 'must keep the order of schemas')
+        self.assertEqual({}, hypotheses.learn_many([([], None, [])], 'CONTAINMENT', {}),
+                         'must not learn anything from empty patterns')
+        store = hypotheses.PatternStore()
+        hypotheses.learn_many(experiences[:3], 'CONTAINMENT', store, inplace=True)
+        self.assertEqual(2, len(store['CONTAINMENT']), 'must learn in place when asked to')
+
+    def test_learn_many_repeated_experience(self):
+        box, fridge = Variable('box', 'c'), Variable('fridge', 'c')
+        key, map_ = Variable('key', 'o'), Variable('map', 'o')
+        first = ([Proposition('in', (box, box)), Proposition('on', (fridge, Variable('I', 'I')))], None,
+                 [Proposition('in', (box, fridge))])
+        repeated = ([Proposition('in', (key, map_)), Proposition('on', (map_, box))], None,
+                    [Proposition('in', (box, key))])
+        sequential = hypotheses.PatternStore()
+        for experience in [first, repeated, repeated]:
+            sequential = hypotheses.learn(experience, 'CONTAINMENT', sequential)
+        batched = hypotheses.learn_many([first, repeated, repeated], 'CONTAINMENT', hypotheses.PatternStore())
+        self.assertEqual(2, len(sequential['CONTAINMENT']),
+                         'the pattern reconciled with the repeated experience must not cover it')
+        self.assertEqual(rename_placeholders(sequential), rename_placeholders(batched),
+                         'must check a repeated experience again once it changed the pattern')
+        self.assertEqual(sequential.index('CONTAINMENT').support, batched.index('CONTAINMENT').support,
+                         'must count the same support as learning one experience at a time')
+
+    def test_learn_many_budget(self):
+        experiences = []
+        for obj in [Variable('bread', 'f'), Variable('orange', 'f'), Variable('apple', 'f')]:
+            for container in [Variable('fridge', 'c'), Variable('box', 'c'), Variable('jar', 'c')]:
+                experiences.append(([Proposition('in', (obj, container))], None,
+                                    [Proposition('in', (obj, Variable('I', 'I')))]))
+                experiences.append(([Proposition('in', (obj, Variable('I', 'I')))], None,
+                                    [Proposition('in', (obj, container))]))
+        experiences += experiences[::3]
+        sequential = hypotheses.PatternStore(max_patterns=4)
+        for experience in experiences:
+            sequential = hypotheses.learn(experience, 'CONTAINMENT', sequential)
+        batched = hypotheses.learn_many(experiences, 'CONTAINMENT', hypotheses.PatternStore(max_patterns=4))
+        self.assertEqual(rename_placeholders(sequential), rename_placeholders(batched),
+                         'must evict the same patterns as learning one experience at a time')
+        self.assertEqual(({'CONTAINMENT': 9}, sequential.index('CONTAINMENT').support),
+                         (batched.evictions, batched.index('CONTAINMENT').support),
+                         'must count the same evictions and support as learning one experience at a time')
+        sequential_use, batched_use = sequential.index('CONTAINMENT').last_use, batched.index('CONTAINMENT').last_use
+        self.assertEqual(sorted(range(4), key=lambda ix: sequential_use[ix]),
+                         sorted(range(4), key=lambda ix: batched_use[ix]),
+                         'must use the patterns in the same order as learning one experience at a time')
+
+    def test_train_parallel(self):
+        background = train(CONTAINMENT_TRAINING[:2], 'SUPPORT')
+        serial = train(CONTAINMENT_TRAINING, 'CONTAINMENT', background)
+        serial = train(SOURCE_PATH_GOAL_TRAINING[:3], 'SOURCE-PATH-GOAL', serial)
+        serial = train(SOURCE_PATH_GOAL_TRAINING[3:], 'SOURCE-PATH-GOAL', serial)
+        serial = train(CONTAINMENT_TRAINING[2:], 'SUPPORT', serial)
+        parallel = train_parallel([('CONTAINMENT', CONTAINMENT_TRAINING),
+                                   ('SOURCE-PATH-GOAL', SOURCE_PATH_GOAL_TRAINING[:3]),
+                                   ('SOURCE-PATH-GOAL', SOURCE_PATH_GOAL_TRAINING[3:]),
+                                   ('SUPPORT', CONTAINMENT_TRAINING[2:])], background, workers=2)
+        self.assertEqual(list(serial), list(parallel), 'must merge schemas in the same order as serial training')
+        self.assertEqual(rename_placeholders(serial), rename_placeholders(parallel),
+                         'must learn the same patterns as serial training')
+        self.assertEqual({name: serial.index(name).support for name in serial},
+                         {name: parallel.index(name).support for name in parallel},
+                         'must count the same support as serial training')
+        self.assertEqual(1, len(background['SUPPORT']), 'must not change the background knowledge')
+        self.assertEqual({}, train_parallel({'CONTAINMENT': []}), 'must not create empty schemas')
+
+    def test_train_parallel_budget(self):
+        experiences = []
+        for obj in [Variable('bread', 'f'), Variable('orange', 'f'), Variable('apple', 'f')]:
+            for container in [Variable('fridge', 'c'), Variable('box', 'c'), Variable('jar', 'c')]:
+                experiences.append(([Proposition('in', (obj, container))], None,
+                                    [Proposition('in', (obj, Variable('I', 'I')))]))
+                experiences.append(([Proposition('in', (obj, Variable('I', 'I')))], None,
+                                    [Proposition('in', (obj, container))]))
+        background = train(experiences[:6], 'CONTAINMENT', hypotheses.PatternStore(max_patterns=4))
+        hypotheses.make_inference(([experiences[3][0][0]], None, []), background)
+        serial = train(experiences[6:] + experiences[:6], 'CONTAINMENT', background)
+        serial = train(experiences[::-1], 'SUPPORT', serial)
+        parallel = train_parallel([('CONTAINMENT', experiences[6:] + experiences[:6]),
+                                   ('SUPPORT', experiences[::-1])], background, workers=2)
+        self.assertEqual({'CONTAINMENT': 8, 'SUPPORT': 12}, serial.evictions, 'must train past the budget')
+        self.assertEqual(serial.evictions, parallel.evictions, 'must evict as many patterns as serial training')
+        self.assertEqual(rename_placeholders(serial), rename_placeholders(parallel),
+                         'must evict the same patterns as serial training')
+        for name in serial:
+            serial_support, serial_usage = serial.index(name).statistics()
+            parallel_support, parallel_usage = parallel.index(name).statistics()
+            self.assertEqual((serial_support, [hits for hits, _ in serial_usage]),
+                             (parallel_support, [hits for hits, _ in parallel_usage]),
+                             'must keep the support and hits of patterns')
+            self.assertEqual(sorted(range(len(serial_usage)), key=lambda ix: serial_usage[ix][1]),
+                             sorted(range(len(parallel_usage)), key=lambda ix: parallel_usage[ix][1]),
+                             'must keep the order in which patterns were last used')
 
     def test_most_similar_pattern(self):
         empty_store = {}
@@ -440,6 +918,64 @@ class TestHypotheses(TestCase):
                                         'CONTAINMENT', result_sixth_source_goal_2)
         #self.assertEqual(hypotheses.VariablePlaceholder, type(result_seventh['CONTAINMENT'][1])
 
+    def test_most_similar_pattern_top_k(self):
+        self.assertEqual([], hypotheses.most_similar_pattern(([], None, []), {}, top_k=3),
+                         'must return an empty list if no patterns were available for matching')
+        facts = [Proposition('at', (Variable('box', 'c'), Variable('room', 'r'))),
+                 Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))]
+        kb = hypotheses.learn(([self.orange_in_fridge], None, [self.orange_in_fridge]), 'CONTAINMENT', {})
+        kb = hypotheses.learn(([self.bread_in_fridge], None, [self.bread_in_fridge]), 'CONTAINMENT', kb)
+        kb = hypotheses.learn(([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))],
+                               agent.Put('key', 'box', facts),
+                               [Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))]),
+                              'CONTAINMENT', kb)
+        kb = hypotheses.learn(([Proposition('in', (Variable('key', 'o'), Variable('chest', 'c')))], None,
+                               [Proposition('in', (Variable('key', 'o'), Variable('chest', 'c')))]), 'SUPPORT', kb)
+        query = ([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))], None, [])
+        self.assertEqual([(kb['CONTAINMENT'][1], 'CONTAINMENT', 2), (kb['SUPPORT'][0], 'SUPPORT', 1),
+                          (kb['CONTAINMENT'][0], 'CONTAINMENT', 0)],
+                         hypotheses.most_similar_pattern(query, kb, top_k=3),
+                         'must return the best patterns ordered by score')
+        self.assertEqual([(kb['CONTAINMENT'][1], 'CONTAINMENT', 2), (kb['SUPPORT'][0], 'SUPPORT', 1)],
+                         hypotheses.most_similar_pattern(query, kb, top_k=2),
+                         'must only keep the top_k best patterns')
+        self.assertEqual(hypotheses.most_similar_pattern(query, kb),
+                         hypotheses.most_similar_pattern(query, kb, top_k=10)[0],
+                         'must rank the best pattern first')
+        tied = hypotheses.learn(([self.orange_in_fridge], None, [self.orange_in_fridge]), 'SUPPORT', {})
+        tied = hypotheses.learn(([self.orange_in_fridge], None, [self.orange_in_fridge]), 'CONTAINMENT', tied)
+        query = ([self.bread_in_fridge], None, [])
+        self.assertEqual(['SUPPORT', 'CONTAINMENT'],
+                         [name for _, name, _ in hypotheses.most_similar_pattern(query, tied, top_k=2)],
+                         'must rank patterns with equal scores in the order they are stored')
+        self.assertEqual('SUPPORT', hypotheses.most_similar_pattern(query, tied)[1],
+                         'must prefer the first of the patterns with equal scores')
+        for backend in ('python', 'numpy'):
+            with self.assertRaises(ValueError, msg='must reject fewer than one pattern to return'):
+                hypotheses.most_similar_pattern(query, tied, top_k=0, backend=backend)
+
+    def test_score_bounds(self):
+        vp = hypotheses.VariablePlaceholder()
+        facts = [Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))]
+        candidate = ([Proposition('in', (vp, Variable('I', 'I')))], agent.Put(vp, 'box', facts),
+                     [Proposition('in', (vp, Variable('box', 'c')))])
+        profile = hypotheses.pattern_profile(candidate)
+        self.assertEqual(profile, hypotheses.pattern_profile(
+            ([Proposition('in', (vp, Variable('me', 'I')))], agent.Put(vp, 'bag', facts),
+             [Proposition('in', (vp, Variable('bag', 'c')))])), 'must not depend on concrete Variables')
+        query = ([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))], agent.Put('key', 'box', facts),
+                 [Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))])
+        self.assertEqual([1, 3, 1], hypotheses.score_bounds(query, profile),
+                         'must bound the rating of each part of the pattern')
+        self.assertEqual(3, hypotheses.score_candidate(query, candidate, hypotheses.score_bounds(query, profile)),
+                         'must score candidates within their bounds')
+        self.assertEqual(None, hypotheses.score_candidate(query, candidate, [1, 3, 1], threshold=5),
+                         'must give up on candidates which can\'t exceed the threshold')
+        self.assertEqual(None, hypotheses.score_bounds(([self.chair_at_kitchen], None, []), profile),
+                         'must recognise candidates which can\'t be compared with the pattern')
+        self.assertEqual([profile], hypotheses.as_pattern_store({'CONTAINMENT': [candidate]}).index('CONTAINMENT')
+                         .profiles, 'must keep the profiles of patterns in the store')
+
     def test_infer(self):
         self.assertEqual((([], None, []), {}), hypotheses.infer(([], None, []), ([], None, [])),
                          'must return empty inferences from empty target and source patterns')
@@ -585,6 +1121,23 @@ class TestHypotheses(TestCase):
         self.assertEqual(Variable('basket', 'c'), infer_potato_was_in_basket[0][0].arguments[1].held_variable,
                          'must correctly infer backwards')
 
+    def test_bound_pattern(self):
+        vp1 = hypotheses.VariablePlaceholder()
+        target = hypotheses.freeze_pattern(([Proposition('in', (vp1, Variable('fridge', 'c')))],
+                                            None,
+                                            [Proposition('at', (vp1, Variable('kitchen', 'r')))]))
+        self.assertRaises(Exception, target[0].append, Proposition('in', (vp1, Variable('box', 'c'))))
+        inference, subs = hypotheses.infer(target, ([Proposition('in', (Variable('milk', 'f'),
+                                                                          Variable('fridge', 'c')))], None, []))
+        self.assertEqual(None, vp1.held_variable, 'must not fill placeholders of the target')
+        self.assertEqual({vp1: Variable('milk', 'f')}, subs, 'must key substitutions by placeholders of the target')
+        self.assertEqual(None, inference.materialized, 'must only build the filled in pattern when it is accessed')
+        pre, _, post = inference
+        self.assertIs(pre[0].arguments[0], post[0].arguments[0], 'must keep placeholders shared')
+        self.assertEqual(Variable('milk', 'f'), post[0].arguments[0].held_variable, 'must fill in bound placeholders')
+        self.assertEqual(inference, pickle.loads(pickle.dumps(inference)), 'must keep bindings when pickled')
+        self.assertEqual(inference, deepcopy(inference), 'must keep bindings when copied')
+
     def test_make_inference(self):
         train_exp_containment = [
             (
@@ -659,4 +1212,89 @@ class TestHypotheses(TestCase):
                          'Must correctly identify action arguments leading to result')
         self.assertEqual(inf2[1].args[1].held_variable, Variable('coffee table', 'o'),
                          'Must correctly identify action arguments leading to result')
-        self.assertEqual(name2, 'SUPPORT', 'Must correctly classify schema type')
\ No newline at end of file
+        self.assertEqual(name2, 'SUPPORT', 'Must correctly classify schema type')
+
+    def test_make_inference_batch(self):
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', kb)
+        queries = [([Proposition('in', (Variable('cookie', 'f'), Variable('fridge', 'c')))], None, []),
+                   ([], agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')), []),
+                   ([], None, []),
+                   ([], agent.Moves(Variable('car', 'o'), Variable('home', 'o'), Variable('London', 'o')), [])] * 3
+        expected = [rename_placeholders(hypotheses.make_inference(query, kb)) for query in queries]
+        self.assertEqual(expected,
+                         [rename_placeholders(result) for result in hypotheses.make_inference_batch(queries, kb)],
+                         'must make the same inferences as make_inference, in order')
+        self.assertEqual(expected, [rename_placeholders(result) for result in
+                                    hypotheses.make_inference_batch(queries, kb, processes=2, chunk_size=5)],
+                         'must make the same inferences in worker processes, in order')
+        self.assertEqual([], hypotheses.make_inference_batch([], kb), 'must handle empty batches')
+
+    def test_query_key(self):
+        vp1, vp2 = hypotheses.VariablePlaceholder(), hypotheses.VariablePlaceholder()
+        self.assertEqual(hypotheses.query_key(([Proposition('in', (vp1, Variable('box', 'c')))], None, [])),
+                         hypotheses.query_key(([Proposition('in', (vp2, Variable('box', 'c')))], None, [])),
+                         'must rename placeholders by position')
+        self.assertNotEqual(hypotheses.query_key(([], agent.Insert(Variable('pen', 'o'), Variable('box', 'c')), [])),
+                            hypotheses.query_key(([], agent.Insert(Variable('pen', 'o'), Variable('jar', 'c')), [])),
+                            'must tell Variables apart')
+        self.assertNotEqual(hypotheses.query_key(([], agent.Insert(Variable('pen', 'o'), Variable('box', 'c')), [])),
+                            hypotheses.query_key(([], agent.Take(Variable('pen', 'o'), Variable('box', 'c')), [])),
+                            'must tell Actions apart')
+
+    def test_canonical_form(self):
+        vp1, vp2 = hypotheses.VariablePlaceholder(position=0), hypotheses.VariablePlaceholder(position=0)
+        pattern1 = ([Proposition('in', (vp1, Variable('box', 'c')))], agent.Take(vp1, Variable('box', 'c')), [])
+        pattern2 = ([Proposition('in', (vp2, Variable('box', 'c')))], agent.Take(vp2, Variable('box', 'c')), [])
+        self.assertEqual(hypotheses.canonical_form(pattern1), hypotheses.canonical_form(pattern2),
+                         'must rename placeholders by first occurrence')
+        self.assertEqual(hypotheses.canonical_hash(pattern1), hypotheses.canonical_hash(pattern2),
+                         'must hash alpha-equivalent patterns alike')
+        self.assertNotEqual(hypotheses.canonical_form(pattern1), hypotheses.canonical_form(
+            ([Proposition('in', (hypotheses.VariablePlaceholder(), Variable('box', 'c')))],
+             agent.Take(vp2, Variable('box', 'c')), [])), 'must tell apart placeholders which are shared differently')
+        vp3 = hypotheses.VariablePlaceholder(position=1)
+        self.assertNotEqual(hypotheses.canonical_form(pattern1), hypotheses.canonical_form(
+            ([Proposition('in', (vp3, Variable('box', 'c')))], agent.Take(vp3, Variable('box', 'c')), [])),
+                            'must tell apart placeholders in different positions')
+
+    def test_inference_cache(self):
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', kb)
+        cache = hypotheses.InferenceCache(max_entries=2)
+        query = ([], agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')), [])
+        result = hypotheses.make_inference(query, kb, cache=cache)
+        self.assertEqual(rename_placeholders(hypotheses.make_inference(query, kb)), rename_placeholders(result),
+                         'must make the same inference as without a cache')
+        self.assertIs(result, hypotheses.make_inference(query, kb, cache=cache), 'must reuse cached results')
+        self.assertEqual((1, 1), (cache.hits, cache.misses), 'must count hits and misses')
+
+        kb = hypotheses.learn(([Proposition('at', (Variable('I', 'I'), Variable('hall', 'r')))],
+                               agent.Go(Variable('attic', 'r')),
+                               [Proposition('at', (Variable('I', 'I'), Variable('attic', 'r')))]), 'BLOCKAGE', kb)
+        self.assertIs(result, hypotheses.make_inference(query, kb, cache=cache),
+                      'must keep results that learning a schema without related patterns can\'t change')
+        kb = hypotheses.learn(([Proposition('in', (Variable('stylus', 'o'), Variable('I', 'I')))],
+                               agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')),
+                               [Proposition('in', (Variable('stylus', 'o'), Variable('garage', 'c')))]),
+                              'SUPPORT', kb)
+        result = hypotheses.make_inference(query, kb, cache=cache)
+        self.assertEqual(('SUPPORT', 1), (result[2], cache.invalidations),
+                         'must invalidate results when a related schema changes')
+
+        for name in ['apple', 'banana']:
+            hypotheses.make_inference(([], agent.Insert(Variable(name, 'o'), Variable('jar', 'c')), []), kb,
+                                      cache=cache)
+        self.assertEqual((2, 1), (len(cache), cache.evictions), 'must evict the least recently used results')
+        self.assertEqual(None, cache.get(query, kb), 'must evict the least recently used results')
+        small = hypotheses.InferenceCache(max_bytes=1)
+        hypotheses.make_inference(query, kb, cache=small)
+        self.assertEqual((0, 0), (len(small), small.size), 'must not keep results larger than the memory limit')
+
+        plain = {name: list(patterns) for name, patterns in kb.items()}
+        with self.assertRaises(Exception, msg='must reject plain dictionaries, whose versions change on every call'):
+            hypotheses.make_inference(query, plain, cache=hypotheses.InferenceCache())
+        batch_cache = hypotheses.InferenceCache()
+        hypotheses.make_inference_batch([query] * 3, plain, cache=batch_cache)
+        self.assertEqual((2, 1, 0), (batch_cache.hits, batch_cache.misses, batch_cache.invalidations),
+                         'must wrap plain dictionaries once for a whole batch')
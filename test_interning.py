@@ -0,0 +1,37 @@
+import pickle
+from unittest import TestCase
+from textworld.logic import Proposition, Variable
+import hypotheses
+import interning
+
+
+class TestInterning(TestCase):
+    def test_proposition(self):
+        interner = interning.Interner()
+        prop = interner.proposition(Proposition('in', (Variable('key', 'o'), Variable('box', 'c'))))
+        self.assertIs(prop, interner.proposition(Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))),
+                      'must return the same object for equal Propositions')
+        self.assertIs(prop, interner.proposition(pickle.loads(pickle.dumps(prop))),
+                      'must return the same object for unpickled Propositions')
+        self.assertIs(interner.variable(Variable('box', 'c')), interner.variable(Variable('box', 'c')),
+                      'must return the same object for equal Variables')
+        vp = hypotheses.VariablePlaceholder()
+        with_placeholder = Proposition('in', (vp, Variable('box', 'c')))
+        self.assertIs(with_placeholder, interner.proposition(with_placeholder),
+                      'must not intern Propositions holding placeholders')
+        self.assertEqual(1, len(interner.propositions), 'must not intern Propositions holding placeholders')
+
+    def test_facts(self):
+        interner = interning.Interner()
+        facts = [Proposition('in', (Variable('key', 'o'), Variable('box', 'c'))),
+                 Proposition('at', (Variable('box', 'c'), Variable('room', 'r')))]
+        interned = interner.facts(facts)
+        self.assertIs(interned, interner.facts(list(reversed(list(reversed(facts))))),
+                      'must return the same object for equal lists of facts')
+        self.assertEqual(tuple(facts), interned, 'must keep the facts in order')
+        self.assertEqual(hash(tuple(facts)), hash(interned), 'must hash like a tuple')
+        self.assertNotEqual(interned, interner.facts(facts[:1]), 'must tell different facts apart')
+        self.assertEqual(interned, interning.Interner().facts(facts),
+                         'must compare facts from different interners element by element')
+        self.assertEqual(tuple, type(pickle.loads(pickle.dumps(interned))), 'must pickle as a tuple')
+        self.assertEqual(2, len(interner.fact_tuples), 'must keep every distinct list of facts once')
@@ -0,0 +1,98 @@
+import os
+import tempfile
+from unittest import TestCase
+from textworld.logic import Proposition, Variable
+from train_test_epl import train, CONTAINMENT_TRAINING, SOURCE_PATH_GOAL_TRAINING
+from test_hypotheses import rename_placeholders
+import agent
+import hypotheses
+import storage
+
+
+class TestStorage(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'kb.epl')
+        facts = [Proposition('in', (Variable('key', 'o'), Variable('I', 'I'))),
+                 Proposition('at', (Variable('box', 'c'), Variable('room', 'r')))]
+        self.kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        self.kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', self.kb)
+        self.kb = train([([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))],
+                          agent.Put('key', 'box', facts),
+                          [Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))]),
+                         ([], agent.Look(), [])], 'SUPPORT', self.kb)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_load(self):
+        storage.save_store(self.kb, self.path)
+        loaded = storage.load_store(self.path)
+        self.assertEqual(['CONTAINMENT', 'SOURCE-PATH-GOAL', 'SUPPORT'], list(loaded),
+                         'must load the schema names in order')
+        self.assertEqual(['CONTAINMENT', 'SOURCE-PATH-GOAL', 'SUPPORT'], loaded.pending(),
+                         'must not decode any schema before it is used')
+        self.assertEqual(len(self.kb['SUPPORT']), len(loaded['SUPPORT']), 'must decode schemas when they are used')
+        self.assertEqual(['CONTAINMENT', 'SOURCE-PATH-GOAL'], loaded.pending(), 'must only decode the used schema')
+        self.assertEqual(rename_placeholders(self.kb), rename_placeholders(loaded),
+                         'must load the same patterns that were saved')
+        self.assertEqual([], loaded.pending(), 'must decode all schemas once all patterns were accessed')
+        self.assertEqual('key', loaded['SUPPORT'][0][1].args[0], 'must keep the arguments of Actions')
+        pre, act, post = loaded['CONTAINMENT'][1]
+        self.assertIs(pre[0].arguments[0], post[0].arguments[0],
+                      'must keep placeholders shared between propositions')
+        self.assertIs(pre[0].arguments[0], act.vars[0], 'must keep placeholders shared with actions')
+        self.assertEqual({name: self.kb.index(name).support for name in self.kb},
+                         {name: loaded.index(name).support for name in loaded}, 'must keep the support of patterns')
+
+    def test_save_load_statistics(self):
+        kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL',
+                   hypotheses.PatternStore(max_patterns=4, max_bytes=100000))
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT', kb)
+        hypotheses.make_inference(([], agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')), []), kb)
+        kb.evict('SOURCE-PATH-GOAL', 0)
+        storage.save_store(kb, self.path)
+        loaded = storage.load_store(self.path)
+        self.assertEqual((4, 100000, {'SOURCE-PATH-GOAL': 1}),
+                         (loaded.max_patterns, loaded.max_bytes, loaded.evictions),
+                         'must keep the budget and evictions')
+        for name in kb:
+            support, usage = kb.index(name).statistics()
+            loaded_support, loaded_usage = loaded.index(name).statistics()
+            self.assertEqual((support, [hits for hits, _ in usage]),
+                             (loaded_support, [hits for hits, _ in loaded_usage]),
+                             'must keep the support and hits of patterns')
+            self.assertEqual(sorted(range(len(usage)), key=lambda ix: usage[ix][1]),
+                             sorted(range(len(loaded_usage)), key=lambda ix: loaded_usage[ix][1]),
+                             'must keep the order in which patterns were last used')
+
+    def test_loaded_store_inference(self):
+        storage.save_store(self.kb, self.path)
+        loaded = storage.load_store(self.path)
+        query = ([], agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')), [])
+        _, _, name, score = hypotheses.make_inference(query, loaded)
+        self.assertEqual(hypotheses.make_inference(query, self.kb)[2:], (name, score),
+                         'must make the same inferences from a loaded store')
+        learned = hypotheses.learn(([Proposition('at', (Variable('I', 'I'), Variable('hall', 'r')))],
+                                    agent.Go(Variable('attic', 'r')),
+                                    [Proposition('at', (Variable('I', 'I'), Variable('attic', 'r')))]),
+                                   'BLOCKAGE', storage.load_store(self.path))
+        self.assertEqual(['CONTAINMENT', 'SOURCE-PATH-GOAL', 'SUPPORT', 'BLOCKAGE'], list(learned),
+                         'must learn into a loaded store')
+        self.assertEqual(['CONTAINMENT', 'SOURCE-PATH-GOAL', 'SUPPORT'], learned.pending(),
+                         'must not decode schemas which learning doesn\'t touch')
+
+    def test_load_version_2(self):  # written before the budget and usage statistics were stored
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', kb)
+        loaded = storage.load_store(os.path.join(os.path.dirname(__file__), 'test_stores', 'kb_v2.epl'))
+        self.assertEqual(rename_placeholders(kb), rename_placeholders(loaded), 'must load the patterns of older files')
+        self.assertEqual({name: kb.index(name).support for name in kb},
+                         {name: loaded.index(name).support for name in loaded}, 'must keep the support of patterns')
+        self.assertEqual((None, None, {}), (loaded.max_patterns, loaded.max_bytes, loaded.evictions),
+                         'must load older files without a budget')
+
+    def test_load_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a pattern store')
+        self.assertRaises(Exception, storage.load_store, self.path)
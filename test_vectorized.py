@@ -0,0 +1,52 @@
+from unittest import TestCase
+from textworld.logic import Proposition, Variable
+from train_test_epl import train, CONTAINMENT_TRAINING, SOURCE_PATH_GOAL_TRAINING, SOURCE_PATH_GOAL_NON_LITERAL, \
+    CONTAINMENT_NON_LITERAL
+import agent
+import hypotheses
+import vectorized
+
+
+class TestVectorized(TestCase):
+    def setUp(self):
+        self.kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        self.kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', self.kb)
+
+    def test_schema_arrays(self):
+        vp = hypotheses.VariablePlaceholder()
+        arrays = vectorized.SchemaArrays([
+            ([Proposition('in', (vp, Variable('box', 'c')))], None, [Proposition('in', (vp, Variable('box', 'c')))]),
+            ([Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))], agent.Take(vp, 'box'), []),
+            ([Proposition('at', (Variable('key', 'o'), Variable('room', 'r')))], None, [])
+        ])
+        scores, comparable = arrays.score(([Proposition('in', (Variable('key', 'o'), Variable('box', 'c')))], None,
+                                           []))
+        self.assertEqual([True, True, False], list(comparable), 'must recognise patterns without a counterpart')
+        self.assertEqual([2, 2], list(scores[:2]), 'must rate arguments and actions like the reference scoring')
+        scores, comparable = arrays.score(([], agent.Take(Variable('key', 'o'), 'box'), []))
+        self.assertEqual([False, True, False], list(comparable), 'must only compare patterns with the same action')
+
+    def test_most_similar_pattern(self):
+        queries = CONTAINMENT_NON_LITERAL + SOURCE_PATH_GOAL_NON_LITERAL + \
+                  [([Proposition('in', (Variable('key', 'o'), Variable('I', 'I')))], None, []),
+                   ([], agent.Insert(Variable('stylus', 'o'), Variable('garage', 'c')), [])]
+        for query in queries:
+            self.assertEqual(hypotheses.most_similar_pattern(query, self.kb),
+                             hypotheses.most_similar_pattern(query, self.kb, backend='numpy'),
+                             'must find the same pattern as the reference implementation')
+            self.assertEqual(hypotheses.most_similar_pattern(query, self.kb, top_k=5),
+                             hypotheses.most_similar_pattern(query, self.kb, top_k=5, backend='numpy'),
+                             'must rank patterns like the reference implementation')
+        self.assertEqual((None, None, None), hypotheses.most_similar_pattern(([], None, []), {}, backend='numpy'),
+                         'must return empty 3-tuple if no patterns were available for matching')
+        self.assertRaises(Exception, hypotheses.most_similar_pattern, queries[0], self.kb, backend='fortran')
+
+    def test_arrays_follow_changes(self):
+        store = hypotheses.as_pattern_store(self.kb)
+        query = ([Proposition('at', (Variable('chair', 'o'), Variable('kitchen', 'r')))], None, [])
+        vectorized.most_similar_pattern(query, store)
+        pattern = ([Proposition('at', (Variable('chair', 'o'), Variable('kitchen', 'r')))], None,
+                   [Proposition('at', (Variable('chair', 'o'), Variable('hall', 'r')))])
+        store.add('CONTAINMENT', pattern)
+        self.assertEqual((pattern, 'CONTAINMENT', 3), vectorized.most_similar_pattern(query, store),
+                         'must score patterns added after the last query')
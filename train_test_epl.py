@@ -1,15 +1,23 @@
 import hypotheses
+import storage
 from agent import Put, Take, Insert, Go, Moves
 from textworld.logic import Proposition, Variable
 from itertools import product
 from random import choices, choice, randint
 from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 import json
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--test-containment', action='store_true', help='Test performance on CONTAINMENT')
 parser.add_argument('--test-source-path-goal', action='store_true', help='Test performance on SOURCE-PATH-GOAL')
+parser.add_argument('--workers', type=int, default=None,
+                    help='Train the schemas and make inferences in parallel using this many worker processes')
+parser.add_argument('--save-kb', help='Save the trained knowledge base to this file')
+parser.add_argument('--load-kb', help='Load a knowledge base saved with --save-kb instead of training one')
+parser.add_argument('--backend', choices=['python', 'numpy'], default='python',
+                    help='Backend used to score patterns when making inferences')
 parser.add_argument('output', help='Output file name')
 
 CONTAINMENT_TRAINING = [
@@ -80,9 +88,50 @@ SOURCE_PATH_GOAL_TRAINING = [
 
 
 def train(experiences, schema_name, background_knowledge={}):
-    store = background_knowledge
-    for exp in experiences:
-        store = hypotheses.learn(exp, schema_name, store)
+    return hypotheses.learn_many(experiences, schema_name, background_knowledge)
+
+
+def train_schema(schema_name, experiences, patterns=None, statistics=None, max_patterns=None, max_bytes=None):
+    '''Trains a single schema, starting from its existing patterns, if any. Run by train_parallel in worker processes.
+    :param statistics - usage statistics of the existing patterns, see SchemaIndex.statistics
+    :param max_patterns, max_bytes - budget of the schema, see PatternStore
+    :return tuple (list of learned patterns, their statistics, number of patterns evicted), or None if the schema is
+    still empty'''
+    store = hypotheses.PatternStore(max_patterns=max_patterns, max_bytes=max_bytes)
+    if patterns is not None:
+        store.assign(schema_name, list(patterns), *statistics)
+    hypotheses.learn_many(experiences, schema_name, store, inplace=True)
+    if schema_name not in store:
+        return None
+    return store[schema_name], store.index(schema_name).statistics(), store.evictions.get(schema_name, 0)
+
+
+def train_parallel(schema_experiences, background_knowledge={}, workers=None):
+    '''Trains several schemas at once, each in its own worker process. Since learning a schema never looks at the
+    patterns of other schemas, the result is the same as calling train for every schema in turn, with the schemas in
+    the same order. Workers keep to the budget of the background knowledge, if it is a PatternStore with one.
+    :param schema_experiences - list of (schema name, experiences) pairs, or a dictionary of experiences by schema name
+    :param workers - maximum number of worker processes, defaults to the number of processors'''
+    if isinstance(schema_experiences, dict):
+        schema_experiences = schema_experiences.items()
+    shards = {}  # schema name -> all of its experiences, in order
+    for schema_name, experiences in schema_experiences:
+        shards.setdefault(schema_name, []).extend(experiences)
+
+    store = hypotheses.as_pattern_store(background_knowledge).copy()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for schema_name, experiences in shards.items():
+            statistics = store.index(schema_name).statistics() if schema_name in store else None
+            futures.append((schema_name, executor.submit(train_schema, schema_name, experiences, store.get(schema_name),
+                                                         statistics, store.max_patterns, store.max_bytes)))
+        for schema_name, future in futures:  # merge in submission order, so that the schema order is deterministic
+            trained = future.result()
+            if trained is not None:  # the placeholders were made in another process, so their ids may clash
+                patterns, statistics, evictions = trained
+                store.assign(schema_name, hypotheses.renumber_placeholders(patterns), *statistics)
+                if evictions:
+                    store.evictions[schema_name] = store.evictions.get(schema_name, 0) + evictions
     return store
 
 CONTAINED_LITERAL = [
@@ -259,8 +308,16 @@ SOURCE_PATH_GOAL_NON_LITERAL = [
 
 if __name__ == '__main__':
     args = parser.parse_args()
-    kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
-    kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', kb)
+    if args.load_kb:
+        kb = storage.load_store(args.load_kb)
+    elif args.workers:
+        kb = train_parallel([('CONTAINMENT', CONTAINMENT_TRAINING), ('SOURCE-PATH-GOAL', SOURCE_PATH_GOAL_TRAINING)],
+                            workers=args.workers)
+    else:
+        kb = train(CONTAINMENT_TRAINING, 'CONTAINMENT')
+        kb = train(SOURCE_PATH_GOAL_TRAINING, 'SOURCE-PATH-GOAL', kb)
+    if args.save_kb:
+        storage.save_store(kb, args.save_kb)
     test_data_literal = []
     test_data_nonliteral = []
     test_data_distraction = generate_test_data(CONTAINED_LITERAL, CONTAINER_LITERAL, 'DISTRACTION')
@@ -273,9 +330,12 @@ if __name__ == '__main__':
     results = {'literal':{}, 'non-literal':{}, 'distraction':{}}
 
     stats_correct = {'literal': 0, 'non-literal': 0, 'distraction': 0}
+    answers = {kind: hypotheses.make_inference_batch(questions[:50], kb, backend=args.backend, processes=args.workers)
+               for kind, questions in (('literal', test_data_literal), ('non-literal', test_data_nonliteral),
+                                       ('distraction', test_data_distraction))}
     for i in range(50):
         question_l = test_data_literal[i]
-        _, _, name, _ = hypotheses.make_inference(question_l, kb)
+        _, _, name, _ = answers['literal'][i]
 
         results['literal'][i] = {'question': str(question_l), 'answer': name}
         if (args.test_containment and name == 'CONTAINMENT') or \
@@ -283,7 +343,7 @@ if __name__ == '__main__':
             stats_correct['literal'] += 1
 
         question_n = test_data_nonliteral[i]
-        _, _, name, _ = hypotheses.make_inference(question_n, kb)
+        _, _, name, _ = answers['non-literal'][i]
 
         results['non-literal'][i] = {'question': str(question_n), 'answer': name}
         if (args.test_containment and name == 'CONTAINMENT') or \
@@ -291,7 +351,7 @@ if __name__ == '__main__':
             stats_correct['non-literal'] += 1
 
         question_d = test_data_distraction[i]
-        _, _, name, _ = hypotheses.make_inference(question_d, kb)
+        _, _, name, _ = answers['distraction'][i]
 
         results['distraction'][i] = {'question': str(question_d), 'answer': name}
         if not (name == 'SOURCE-PATH-GOAL' or name == 'CONTAINMENT'):
@@ -0,0 +1,126 @@
+import numpy as np
+
+import agent
+import hypotheses
+
+MISSING = np.iinfo(np.int64).min  # rating of a proposition which has no counterpart in a pattern
+PADDING = -1  # id of the arguments past the end of shorter argument lists, never equal to an interned term
+
+
+class SchemaArrays:
+    '''Encodes the patterns of a single schema into NumPy arrays, so that a query can be scored against all of them at
+    once. Proposition names, action types and arguments are interned into integer ids; propositions are grouped by side,
+    name and arity, so that the arguments of a group form a matrix with one row per proposition.'''
+
+    def __init__(self, patterns):
+        self.size = len(patterns)
+        self.terms = {}  # term -> id, concrete Variables and VariablePlaceholders alike
+        self.action_types = {type(None): 0}  # action type -> id
+        groups = {}  # (side, name, arity) -> (pattern positions, argument ids, placeholder flags)
+        act_types, act_lengths, act_vars = [], [], []
+        for ix, (pre, act, post) in enumerate(patterns):
+            for side, props in ((0, pre), (2, post)):
+                for prop in props:
+                    rows = groups.setdefault((side, prop.name, len(prop.arguments)), ([], [], []))
+                    rows[0].append(ix)
+                    rows[1].append([self.term(arg) for arg in prop.arguments])
+                    rows[2].append(list(hypotheses.placeholder_mask(prop)))
+            act_types.append(self.action_types.setdefault(type(act), len(self.action_types)))
+            act_vars.append(list(act.vars) if isinstance(act, agent.Action) else [])
+            act_lengths.append(len(act_vars[-1]))
+
+        self.groups = {}
+        for key, (positions, args, masks) in groups.items():
+            arity = key[2]
+            self.groups[key] = (np.array(positions, dtype=np.int64),
+                                np.array(args, dtype=np.int64).reshape(len(positions), arity),
+                                np.array(masks, dtype=bool).reshape(len(positions), arity))
+        self.act_types = np.array(act_types, dtype=np.int64)
+        self.act_lengths = np.array(act_lengths, dtype=np.int64)
+        width = max(act_lengths) if act_lengths else 0
+        self.act_vars = np.full((self.size, width), PADDING, dtype=np.int64)
+        self.act_placeholders = np.zeros((self.size, width), dtype=bool)
+        for ix, variables in enumerate(act_vars):
+            self.act_vars[ix, :len(variables)] = [self.term(var) for var in variables]
+            self.act_placeholders[ix, :len(variables)] = [isinstance(var, hypotheses.VariablePlaceholder)
+                                                          for var in variables]
+
+    def term(self, term):
+        return self.terms.setdefault(term, len(self.terms))
+
+    def lookup(self, term):
+        '''Returns the id of a term of a query, or PADDING - 1 if the term doesn't occur in the schema.'''
+        return self.terms.get(term, PADDING - 1)
+
+    def score(self, pattern):
+        '''Scores the given pattern against every pattern of the schema, like hypotheses.score_candidate does for a
+        single one.
+        :return tuple (scores, comparable) of arrays with an entry for every pattern in the schema; scores are only
+        meaningful where the pattern could be compared'''
+        pre, act, post = pattern
+        scores = np.zeros(self.size, dtype=np.int64)
+        comparable = np.ones(self.size, dtype=bool)
+        for side, props in ((0, pre), (2, post)):
+            for prop in props:
+                group = self.groups.get((side, prop.name, len(prop.arguments)))
+                if group is None:
+                    return scores, np.zeros(self.size, dtype=bool)
+                positions, args, masks = group
+                mask = np.array(hypotheses.placeholder_mask(prop), dtype=bool)
+                ids = np.array([self.lookup(arg) for arg in prop.arguments], dtype=np.int64)
+                # +1 for equal arguments or two placeholders, 0 for a placeholder and a concrete argument, -1 otherwise
+                ratings = np.where(mask & masks, 1, np.where(mask ^ masks, 0, np.where(args == ids, 1, -1)))
+                best = np.full(self.size, MISSING, dtype=np.int64)
+                np.maximum.at(best, positions, ratings.sum(axis=1))
+                comparable &= best != MISSING
+                scores += np.where(best != MISSING, best, 0)
+
+        if act is None:
+            scores += self.act_types == 0  # both actions being None still counts as a match
+            return scores, comparable
+        comparable &= self.act_types == self.action_types.get(type(act), -1)
+        scores += 1
+        if isinstance(act, agent.Action) and len(act.vars) and self.act_vars.shape[1]:
+            width = min(len(act.vars), self.act_vars.shape[1])
+            ids = np.array([self.lookup(var) for var in act.vars[:width]], dtype=np.int64)
+            mask = np.array([isinstance(var, hypotheses.VariablePlaceholder) for var in act.vars[:width]], dtype=bool)
+            # +1 for equal variables, 0 for two different placeholders, -1 otherwise; only as far as both lists go
+            ratings = np.where(self.act_vars[:, :width] == ids, 1,
+                               np.where(mask & self.act_placeholders[:, :width], 0, -1))
+            present = np.arange(width) < np.minimum(self.act_lengths, len(act.vars))[:, None]
+            scores += np.where(present, ratings, 0).sum(axis=1)
+        return scores, comparable
+
+
+def schema_arrays(store, name):
+    '''Returns the SchemaArrays for the named schema of a PatternStore, encoding the schema if it changed since the last
+    time.'''
+    index = store.index(name)
+    if index.arrays is None:
+        index.arrays = SchemaArrays(store[name])
+    return index.arrays
+
+
+def most_similar_pattern(pattern, pattern_store, top_k=1):
+    '''NumPy version of hypotheses.most_similar_pattern, giving the same results. Every schema is encoded into arrays
+    the first time it is queried after it changed, so this pays off for repeated queries against large stores.'''
+    nothing = (None, None, None) if top_k == 1 else []
+    if len(pattern_store) == 0 or pattern == ([], None, []):
+        return nothing
+    store = hypotheses.as_pattern_store(pattern_store)
+    names, positions, scores = [], [], []
+    for name in store:
+        schema_scores, comparable = schema_arrays(store, name).score(pattern)
+        found = np.flatnonzero(comparable)
+        names.append(np.full(len(found), len(names), dtype=np.int64))
+        positions.append(found)
+        scores.append(schema_scores[found])
+    names, positions, scores = np.concatenate(names), np.concatenate(positions), np.concatenate(scores)
+    if not len(scores):
+        return nothing
+    schema_names = list(store)
+    if top_k == 1:
+        best = int(np.argmax(scores))  # the first of the best scores, as in the order patterns are stored
+        return store[schema_names[names[best]]][positions[best]], schema_names[names[best]], int(scores[best])
+    ranking = np.argsort(-scores, kind='stable')[:top_k]
+    return [(store[schema_names[names[ix]]][positions[ix]], schema_names[names[ix]], int(scores[ix])) for ix in ranking]